@@ -1,3 +1,5 @@
+import threading
+
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
@@ -63,14 +65,34 @@ class RPGAndroidApp(App):
             self.stop()
         else:
             self.output_label.text += f"\nYou: {user_input}"
-            Clock.schedule_once(lambda dt: self.stream_response(response_generator), 0)
+            self.stream_response(response_generator)
 
     def stream_response(self, response_generator):
-        response = ""
-        for token in response_generator:
-            response += token
-            self.output_label.text += token
-            Clock.schedule_once(lambda dt: None, 0)  # Force UI update
+        # The response is read on a worker thread, the label is updated at most once per refresh
+        # interval instead of re-rendering the whole text for every token.
+        # The app is packaged on its own, so it collects the chunks itself instead of using the
+        # server's StreamAccumulator. list.append is atomic, the refresh only joins the new chunks.
+        chunks = []
+        output = [self.output_label.text, 0]
+        done = threading.Event()
+
+        def read_response():
+            try:
+                for token in response_generator:
+                    chunks.append(token)
+            finally:
+                done.set()
+
+        def refresh_output(dt):
+            finished = done.is_set()
+            count = len(chunks)
+            output[0] += "".join(chunks[output[1]:count])
+            output[1] = count
+            self.output_label.text = output[0]
+            return not finished
+
+        threading.Thread(target=read_response, daemon=True).start()
+        Clock.schedule_interval(refresh_output, 0.05)
 
 if __name__ == '__main__':
     RPGAndroidApp().run()
\ No newline at end of file
@@ -0,0 +1,179 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import AsyncGenerator, AsyncIterable, Awaitable, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class _StreamError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def iterate_in_thread(iterable: Iterable[T], max_buffered: int = 256) -> AsyncGenerator[T, None]:
+    """
+    Iterate a blocking iterable on a dedicated thread and yield its items on the event loop.
+
+    The thread hands items over through a bounded queue, so a slow consumer pauses the producer
+    instead of buffering the whole stream. If the consumer stops early, the producer thread stops
+    at the next item and closes the iterable.
+
+    Args:
+        iterable (Iterable[T]): The blocking iterable, like the streaming response of a provider.
+        max_buffered (int): Maximum number of items waiting for the consumer.
+
+    Yields:
+        T: The items of the iterable.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stopped.is_set():
+                    future.cancel()
+                    return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if stopped.is_set() or not put(item):
+                    break
+        except BaseException as e:
+            put(_StreamError(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None and stopped.is_set():
+                close()
+            put(_STOP)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+class CoalescingStats:
+    """Chunks received from the stream and frames and characters sent to the client for one response."""
+
+    def __init__(self):
+        self.chunks_received = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def to_dict(self):
+        return {"chunks_received": self.chunks_received, "frames_sent": self.frames_sent,
+                "bytes_sent": self.bytes_sent}
+
+
+async def send_coalesced(chunks: AsyncIterable[str], send: Callable[[str], Awaitable[None]],
+                         flush_interval: float = 0.025, flush_bytes: int = 1024,
+                         max_queued_frames: int = 32) -> CoalescingStats:
+    """
+    Forward a stream of text chunks to a client, merging chunks into fewer, larger frames.
+
+    Buffered chunks are flushed as one frame once flush_interval seconds passed since the first
+    buffered chunk or flush_bytes characters are buffered. Frames are sent by a separate task from a
+    bounded queue; when a slow client lets the queue fill up, reading from the stream pauses, which
+    pauses the producer of the stream in turn.
+
+    Args:
+        chunks (AsyncIterable[str]): The stream of chunks.
+        send (Callable[[str], Awaitable[None]]): Sends one frame to the client.
+        flush_interval (float): Maximum time in seconds a chunk is held back, 0 sends every chunk as its own frame.
+        flush_bytes (int): Buffered characters that trigger a flush.
+        max_queued_frames (int): Maximum number of frames waiting to be sent.
+
+    Returns:
+        CoalescingStats: Chunks received and frames and characters sent.
+    """
+    loop = asyncio.get_running_loop()
+    stats = CoalescingStats()
+    frames: asyncio.Queue = asyncio.Queue(maxsize=max(max_queued_frames, 1))
+    incoming: asyncio.Queue = asyncio.Queue(maxsize=max(max_queued_frames, 1))
+
+    async def sender():
+        while True:
+            frame = await frames.get()
+            if frame is _STOP:
+                return
+            await send(frame)
+            stats.frames_sent += 1
+            stats.bytes_sent += len(frame)
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                await incoming.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await incoming.put(_StreamError(e))
+            return
+        finally:
+            close = getattr(chunks, "aclose", None)
+            if close is not None:
+                await close()
+        await incoming.put(_STOP)
+
+    async def enqueue(frame):
+        # Waits for room in the queue, unless the sender failed, e.g. because the client disconnected.
+        put = asyncio.ensure_future(frames.put(frame))
+        await asyncio.wait({put, sender_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            sender_task.result()
+
+    sender_task = asyncio.create_task(sender())
+    pump_task = asyncio.create_task(pump())
+    buffer = []
+    buffered = 0
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(incoming.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            if item is _STOP:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+
+            if item is not None:
+                stats.chunks_received += 1
+                buffer.append(item)
+                buffered += len(item)
+                if deadline is None:
+                    deadline = loop.time() + flush_interval
+
+            if buffer and (item is None or buffered >= flush_bytes or loop.time() >= deadline):
+                await enqueue("".join(buffer))
+                buffer, buffered, deadline = [], 0, None
+
+        if buffer:
+            await enqueue("".join(buffer))
+        await enqueue(_STOP)
+        await sender_task
+    finally:
+        pump_task.cancel()
+        sender_task.cancel()
+    return stats
@@ -0,0 +1,214 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+from chat_api import ChatAPI
+
+
+class Backend:
+    """
+    One model server of a routed backend list.
+
+    Attributes:
+        url (str): API URL of the server.
+        outstanding (int): Requests currently running on the server.
+        latency (float | None): Exponentially weighted moving average of the time to the first token in seconds.
+        consecutive_failures (int): Failed requests since the last successful one.
+        ejected_until (float): Monotonic time until which the server gets no requests.
+        requests (int): Number of requests sent to the server.
+        failures (int): Number of failed requests.
+        ejections (int): Number of times the server got ejected.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency: float | None = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "latency_ms": self.latency * 1000 if self.latency is not None else None,
+            "ejected": self.ejected_until > time.monotonic(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class BackendRouter:
+    """
+    Picks the server of a list of replicas for each request.
+
+    The "least_outstanding" policy picks the server with the fewest running requests, the "ewma"
+    policy the one with the lowest time to first token, weighted by its running requests. Servers
+    that fail max_failures requests in a row, or whose latency exceeds slow_seconds, are ejected for
+    eject_seconds. A game master stays on the server of its previous request, so the server can reuse
+    the cached prompt, as long as that server is available and has at most sticky_slack more running
+    requests than the best one, with the "ewma" policy also at most sticky_latency_factor times its latency.
+    """
+    POLICIES = ("least_outstanding", "ewma")
+
+    def __init__(self, urls: List[str], policy: str = "least_outstanding", max_failures: int = 3,
+                 eject_seconds: float = 30.0, slow_seconds: float = 0.0, sticky_slack: int = 2,
+                 sticky_latency_factor: float = 2.0, ewma_alpha: float = 0.3):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unsupported routing policy: {policy}")
+        if not urls:
+            raise ValueError("At least one backend URL is required")
+        self.backends = [Backend(url) for url in urls]
+        self.policy = policy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.slow_seconds = slow_seconds
+        self.sticky_slack = sticky_slack
+        self.sticky_latency_factor = sticky_latency_factor
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+
+    def acquire(self, preferred: Optional[Backend] = None) -> Backend:
+        """Pick the server for a request and count the request as running on it."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend.is_available(now)]
+            if not candidates:
+                # All servers are ejected, the one whose ejection ends first is the best bet.
+                candidates = [min(self.backends, key=lambda backend: backend.ejected_until)]
+
+            best = min(candidates, key=self._cost)
+            if preferred is not None and preferred in candidates and self._is_close_enough(preferred, best):
+                best = preferred
+
+            best.outstanding += 1
+            best.requests += 1
+            return best
+
+    def release(self, backend: Backend, latency: float | None, failed: bool) -> None:
+        """
+        Record the outcome of a request.
+
+        Args:
+            backend (Backend): The server of the request.
+            latency (float | None): Time to the first token in seconds, None if no token arrived.
+            failed (bool): Whether the request failed.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            now = time.monotonic()
+            if failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.max_failures:
+                    self._eject(backend, now)
+                return
+
+            backend.consecutive_failures = 0
+            if latency is not None:
+                if backend.latency is None:
+                    backend.latency = latency
+                else:
+                    backend.latency += self.ewma_alpha * (latency - backend.latency)
+                if 0 < self.slow_seconds < backend.latency:
+                    self._eject(backend, now)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _cost(self, backend: Backend) -> float:
+        if self.policy == "least_outstanding" or backend.latency is None:
+            return backend.outstanding
+        return backend.latency * (backend.outstanding + 1)
+
+    def _is_close_enough(self, preferred: Backend, best: Backend) -> bool:
+        if preferred.outstanding > best.outstanding + self.sticky_slack:
+            return False
+        if self.policy == "ewma" and preferred.latency is not None and best.latency is not None:
+            return preferred.latency <= best.latency * self.sticky_latency_factor
+        return True
+
+    def _eject(self, backend: Backend, now: float) -> None:
+        backend.ejected_until = now + self.eject_seconds
+        backend.ejections += 1
+        # It rejoins with a clean slate, old failures and latencies must not eject it again right away.
+        backend.consecutive_failures = 0
+        backend.latency = None
+
+
+class RoutedChatAPI:
+    """
+    Chat API of one game master that sends each request to a server picked by a BackendRouter.
+
+    All servers share the settings of this API.
+    """
+
+    def __init__(self, router: BackendRouter, api_factory: Callable[[str], ChatAPI]):
+        self.router = router
+        self._apis = {backend.url: api_factory(backend.url) for backend in router.backends}
+        self.settings = self._apis[router.backends[0].url].settings
+        for api in self._apis.values():
+            api.settings = self.settings
+        self.backend: Backend | None = None
+
+    def get_current_settings(self):
+        return self.settings
+
+    def get_response(self, messages: List[Dict[str, Any]]) -> str:
+        backend = self.router.acquire(self.backend)
+        self.backend = backend
+        start = time.perf_counter()
+        try:
+            response = self._apis[backend.url].get_response(messages)
+        except BaseException:
+            self.router.release(backend, None, failed=True)
+            raise
+        self.router.release(backend, time.perf_counter() - start, failed=False)
+        return response
+
+    def get_streaming_response(self, messages: List[Dict[str, Any]]) -> Generator[str, None, None]:
+        backend = self.router.acquire(self.backend)
+        self.backend = backend
+        start = time.perf_counter()
+        latency = None
+        failed = False
+        try:
+            for chunk in self._apis[backend.url].get_streaming_response(messages):
+                if latency is None:
+                    latency = time.perf_counter() - start
+                yield chunk
+        except GeneratorExit:
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.router.release(backend, latency, failed)
+
+
+_routers: Dict[tuple, BackendRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(key: tuple, create: Callable[[], BackendRouter]) -> BackendRouter:
+    """Process wide router of a backend list, so all game masters see the same load and health."""
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = create()
+            _routers[key] = router
+        return router
+
+
+def router_stats() -> List[Dict[str, Any]]:
+    with _routers_lock:
+        routers = list(_routers.values())
+    return [{"policy": router.policy, "backends": router.stats()} for router in routers]
@@ -0,0 +1,48 @@
+"""
+Memory of a large chat history.
+
+Writes a history of synthetic messages, loads it with ChatHistory and prints the memory of the
+loaded messages measured with tracemalloc, in total and without the message contents. Usage,
+from the repository root:
+
+    python -m benchmarks.history_memory [--messages N] [--content-length N]
+"""
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import tracemalloc
+
+from chat_history import ChatHistory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--content-length", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as history_folder:
+        messages = [{"role": "user" if i % 2 else "assistant", "content": f"{i} " + "x" * args.content_length, "id": i}
+                    for i in range(args.messages)]
+        with open(f"{history_folder}/chat_history_20240101_000000.json", "w") as f:
+            json.dump(messages, f)
+        del messages
+
+        gc.collect()
+        tracemalloc.start()
+        history = ChatHistory(history_folder)
+        history.load_history()
+        gc.collect()
+        total, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        contents = sum(sys.getsizeof(message.content) for message in history.messages)
+        overhead = total - contents
+        print(f"{len(history.messages)} messages: {total / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB")
+        print(f"without contents: {overhead / 2 ** 20:.1f} MiB ({overhead / len(history.messages):.0f} B/message)")
+
+
+if __name__ == "__main__":
+    main()
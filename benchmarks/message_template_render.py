@@ -0,0 +1,34 @@
+"""
+Render latency of MessageTemplate.generate_message_content.
+
+Renders every system message template in prompts/ with the template fields of a game starter and
+prints the mean time per render. Usage, from the repository root:
+
+    python -m benchmarks.message_template_render [--game-starter FILE] [--renders N]
+"""
+import argparse
+import glob
+import os
+import timeit
+
+from game_state import GameState
+from message_template import MessageTemplate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--game-starter", default=os.path.join(ROOT, "game_starters", "rpg_candlekeep.yaml"))
+    parser.add_argument("--renders", type=int, default=5000)
+    args = parser.parse_args()
+
+    template_fields = GameState(args.game_starter).template_fields
+    for template_file in sorted(glob.glob(os.path.join(ROOT, "prompts", "*"))):
+        template = MessageTemplate.from_file(template_file)
+        seconds = timeit.timeit(lambda: template.generate_message_content(template_fields), number=args.renders)
+        print(f"{os.path.basename(template_file)}: {seconds / args.renders * 1e6:.1f} us per render")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
+import copy
 import json
 
 from chat_api import ChatAPI, OpenAIChatAPI, OpenRouterAPI, OpenRouterAPIPromptMode, LlamaAgentProvider, \
     LlamaAgentProviderCustom, AnthropicChatAPI, MistralChatAPI, GroqChatAPI
-from virtual_game_master import VirtualGameMasterConfig
+from config import VirtualGameMasterConfig
+from provider_pool import provider_pool
+from llama_cpp_slots import detect_llama_cpp_slots
+from backend_router import BackendRouter, RoutedChatAPI, get_router
 
 
 class VirtualGameMasterChatAPISelector:
@@ -10,6 +14,58 @@ class VirtualGameMasterChatAPISelector:
         self.config = config
 
     def get_api(self) -> ChatAPI:
+        """
+        Get the chat API of the config with its sampling settings applied.
+
+        With PROVIDER_POOL_SIZE > 0 the API is backed by the provider clients shared by all game
+        masters using the same API_TYPE, API_URL, API_KEY and MODEL, otherwise a new client is created.
+        With more than one URL in API_URLS, each request is routed to one of the servers.
+        """
+        urls = [url.strip() for url in self.config.API_URLS.split(",") if url.strip()]
+        if len(urls) > 1:
+            api = self._get_routed_api(urls)
+        elif urls:
+            config = copy.copy(self.config)
+            config.API_URL = urls[0]
+            api = VirtualGameMasterChatAPISelector(config)._get_backend_api()
+        else:
+            api = self._get_backend_api()
+
+        self.apply_settings(api)
+        return api
+
+    def _get_backend_api(self) -> ChatAPI:
+        if self.config.PROVIDER_POOL_SIZE <= 0:
+            return self.create_provider()
+
+        key = (self.config.API_TYPE, self.config.API_URL, self.config.API_KEY, self.config.MODEL)
+        # The pool creates more clients later, from a copy since the config can still change.
+        factory = VirtualGameMasterChatAPISelector(copy.copy(self.config)).create_provider
+        slot_count = self.get_llama_cpp_slot_count if self.config.API_TYPE in ["llamacpp", "llamacpp_custom"] else None
+        return provider_pool.get(key, factory, self.config.PROVIDER_POOL_SIZE, slot_count)
+
+    def _get_routed_api(self, urls: list[str]) -> RoutedChatAPI:
+        key = (self.config.API_TYPE, tuple(urls), self.config.API_KEY, self.config.MODEL)
+        router = get_router(key, lambda: BackendRouter(
+            urls, self.config.BACKEND_ROUTING, self.config.BACKEND_MAX_FAILURES,
+            self.config.BACKEND_EJECT_SECONDS, self.config.BACKEND_SLOW_SECONDS))
+
+        def backend_api(url: str) -> ChatAPI:
+            config = copy.copy(self.config)
+            config.API_URL = url
+            return VirtualGameMasterChatAPISelector(config)._get_backend_api()
+
+        return RoutedChatAPI(router, backend_api)
+
+    def get_llama_cpp_slot_count(self) -> int | None:
+        """Parallel slots of the llama.cpp server: LLAMACPP_SLOTS if positive, detected from the server if 0, None (no slot pinning) if negative."""
+        if self.config.LLAMACPP_SLOTS < 0:
+            return None
+        if self.config.LLAMACPP_SLOTS > 0:
+            return self.config.LLAMACPP_SLOTS
+        return detect_llama_cpp_slots(self.config.API_URL, self.config.API_KEY)
+
+    def create_provider(self) -> ChatAPI:
         if self.config.API_TYPE == "openai":
             api = OpenAIChatAPI(self.config.API_KEY, self.config.API_URL, self.config.MODEL)
         elif self.config.API_TYPE == "openrouter":
@@ -28,7 +84,10 @@ class VirtualGameMasterChatAPISelector:
             api = MistralChatAPI(self.config.API_KEY, self.config.MODEL)
         else:
             raise ValueError(f"Unsupported API type: {self.config.API_TYPE}")
+        return api
 
+    def apply_settings(self, api: ChatAPI) -> None:
+        """Set the sampling settings of the config on an API, used for new APIs and to change settings in place."""
         # Set common settings
         api.settings.temperature = self.config.TEMPERATURE
         api.settings.top_p = self.config.TOP_P
@@ -48,5 +107,3 @@ class VirtualGameMasterChatAPISelector:
 
         if self.config.API_TYPE == "groq":
             api.settings.stop = json.loads(self.config.STOP_SEQUENCES)
-
-        return api
@@ -0,0 +1,545 @@
+import bisect
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from collections import deque
+from collections.abc import Sequence
+from typing import Callable, Dict, Any, Iterator, List, Tuple
+
+from save_manifest import SaveManifest
+from token_counter import TokenCounter
+
+
+class ChatFormatter:
+    def __init__(self, template, role_names: Dict[str, str] = None):
+        self.template = template
+        self.role_names = role_names or {}
+
+    def format_messages(self, messages):
+        formatted_chat = []
+        for message in messages:
+            role = message['role']
+            content = message['content']
+            display_name = self.role_names.get(role, role.capitalize())
+            formatted_message = self.template.format(role=display_name, content=content)
+            formatted_chat.append(formatted_message)
+        return '\n'.join(formatted_chat)
+
+
+class Message:
+    # No per-instance __dict__, long histories hold hundreds of thousands of messages.
+    __slots__ = ("role", "_content", "token_count", "_id", "_dict")
+
+    def __init__(self, role: str, content: str, message_id: int = None):
+        # Roles loaded from JSON are separate string objects, interned all messages share a few.
+        self.role = sys.intern(role)
+        self._content = content
+        # Filled in by ChatHistory.count_tokens and reset whenever the content changes.
+        self.token_count: int | None = None
+        self._id = message_id
+        self._dict: Dict[str, Any] | None = None
+
+    @property
+    def content(self) -> str:
+        return self._content
+
+    @content.setter
+    def content(self, content: str) -> None:
+        self._content = content
+        self.token_count = None
+        self._dict = None
+
+    @property
+    def id(self) -> int | None:
+        return self._id
+
+    @id.setter
+    def id(self, message_id: int | None) -> None:
+        self._id = message_id
+        self._dict = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The message as dict. The dict is created once and shared until the message changes, callers
+        must not modify it.
+        """
+        if self._dict is None:
+            self._dict = {"role": self.role, "content": self._content, "id": self._id}
+        return self._dict
+
+
+class HistoryView(Sequence):
+    """
+    Read-only view of a range of the history messages as dicts.
+
+    The dicts are only created when accessed and are shared with the messages, see Message.to_dict.
+    The range is fixed when the view is created, use list(view) for a snapshot that is independent
+    of later changes to the history.
+    """
+
+    def __init__(self, messages: List[Message], start: int = 0, end: int = None):
+        self._messages = messages
+        self._start, self._end, _ = slice(start, end).indices(len(messages))
+
+    def __len__(self) -> int:
+        return max(self._end - self._start, 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, end, step)]
+            return HistoryView(self._messages, self._start + start, self._start + max(end, start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history view index out of range")
+        return self._messages[self._start + index].to_dict()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for message in self._messages[self._start:self._end]:
+            yield message.to_dict()
+
+
+class ChatHistory:
+    """
+    Chat history of a game, persisted in the history folder.
+
+    In snapshot mode (the default) every call to save_history writes the complete history
+    into a new chat_history_<timestamp>.json file.
+
+    In journal mode every add/edit/delete is appended as a single JSON line to the journal
+    file, so the I/O per turn does not depend on the length of the history. Once the journal
+    holds compact_every entries, save_history writes a checkpoint (a regular chat_history_*.json
+    snapshot) and starts a new journal on top of it. load_history replays checkpoint + journal.
+
+    Every change increases version. The ids changed by the last CHANGE_LOG_SIZE changes are kept,
+    so clients can ask for the changes since the version they have, see changes_since. epoch is
+    renewed on every load, a version is only meaningful together with its epoch.
+    """
+    JOURNAL_FILE = "chat_history_journal.jsonl"
+    CHANGE_LOG_SIZE = 1000
+
+    def __init__(self, history_folder: str, journal_mode: bool = False, compact_every: int = 200,
+                 token_counter: TokenCounter = None):
+        self.messages: List[Message] = []
+        self.token_counter = token_counter or TokenCounter()
+        self.history_folder = history_folder
+        self.journal_mode = journal_mode
+        self.compact_every = compact_every
+        self.journal_entries = 0
+        self.journal_checkpoint: str | None = None
+        self.lock = threading.RLock()
+        self.total_tokens = 0
+        self.next_message_id = 0
+        # Position of each message id in messages, kept up to date by every change of messages.
+        self._index: Dict[int, int] = {}
+        self.version = 0
+        self.epoch = uuid.uuid4().hex[:12]
+        # (version, message id) of the recent changes, oldest first.
+        self._changes: deque[Tuple[int, int]] = deque(maxlen=self.CHANGE_LOG_SIZE)
+        # Newest version whose changes were dropped from the log, older versions can't be answered.
+        self._changes_floor = 0
+        self._change_listeners: List[Callable[[int, int, int], None]] = []
+        self._manifest: SaveManifest | None = None
+
+    @property
+    def manifest(self) -> SaveManifest:
+        if self._manifest is None:
+            self._manifest = SaveManifest.load(self.history_folder)
+        return self._manifest
+
+    def add_message(self, message: Message):
+        with self.lock:
+            self._append(message)
+            self.total_tokens += self.count_tokens(message)
+            self._record_change(message.id)
+            self._notify(len(self.messages) - 1, self.count_tokens(message), 0)
+            self._append_journal({"op": "add", "message": message.to_dict()})
+
+    def get_message(self, message_id: int) -> Message | None:
+        index = self._index.get(message_id)
+        return self.messages[index] if index is not None else None
+
+    def edit_message(self, message_id: int, new_content: str) -> bool:
+        with self.lock:
+            message = self.get_message(message_id)
+            if message is None:
+                return False
+            old_tokens = self.count_tokens(message)
+            message.content = new_content
+            self.total_tokens += self.count_tokens(message) - old_tokens
+            self._record_change(message_id)
+            self._notify(self._index[message_id], self.count_tokens(message) - old_tokens, 0)
+            self._append_journal({"op": "edit", "id": message_id, "content": new_content})
+            return True
+
+    def delete_message(self, message_id: int) -> bool:
+        with self.lock:
+            index = self._index.get(message_id)
+            if index is None:
+                return False
+            tokens = self.count_tokens(self.messages[index])
+            self.total_tokens -= tokens
+            self._delete_at(index)
+            self._record_change(message_id)
+            self._notify(index, -tokens, 1)
+            self._append_journal({"op": "delete", "id": message_id})
+            return True
+
+    def delete_last_messages(self, count: int) -> int:
+        with self.lock:
+            deleted = min(count, len(self.messages))
+            if deleted > 0:
+                tokens = sum(self.count_tokens(message) for message in self.messages[-deleted:])
+                self.total_tokens -= tokens
+                deleted_ids = [message.id for message in self.messages[-deleted:]]
+                self._delete_last(deleted)
+                self._record_change(*deleted_ids)
+                self._notify(len(self.messages), -tokens, deleted)
+                self._append_journal({"op": "delete_last", "count": deleted})
+            return deleted
+
+    def add_change_listener(self, listener: Callable[[int, int, int], None]) -> None:
+        """
+        Call listener(position, token_delta, removed) after every add, edit or delete.
+
+        position is the index of the changed message, or of the first removed one, token_delta the
+        change of total_tokens and removed the number of removed messages. Loading the history
+        does not call the listeners.
+        """
+        self._change_listeners.append(listener)
+
+    def _notify(self, position: int, token_delta: int, removed: int) -> None:
+        for listener in self._change_listeners:
+            listener(position, token_delta, removed)
+
+    def count_tokens(self, message: Message) -> int:
+        """Token count of a message, counted once and cached on the message until its content changes."""
+        if message.token_count is None:
+            message.token_count = self.token_counter.count(message.content)
+        return message.token_count
+
+    def set_token_counter(self, token_counter: TokenCounter) -> None:
+        """Switch to another token counter, dropping the token counts cached on the messages."""
+        with self.lock:
+            self.token_counter = token_counter
+            for message in self.messages:
+                message.token_count = None
+            self.total_tokens = sum(self.count_tokens(message) for message in self.messages)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        # Fresh dicts that are not cached on the messages, so saving or sending the whole history
+        # does not keep a dict alive for every message.
+        return [self._copy_dict(message) for message in self.messages]
+
+    def window(self, start: int = 0, end: int = None) -> HistoryView:
+        """View of the messages from start to end as dicts, without copying the rest of the history."""
+        return HistoryView(self.messages, start, end)
+
+    def page(self, before_id: int = None, after_id: int = None, limit: int = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        A page of the history, for clients that load long histories piece by piece.
+
+        Args:
+            before_id (int, optional): Only messages before the message with this id.
+            after_id (int, optional): Only messages after the message with this id.
+            limit (int, optional): Maximum number of messages. The page holds the first messages
+                after after_id if it is given, the last messages before before_id (or the end) otherwise.
+
+        Returns:
+            The messages of the page and whether there are more messages in the paging direction.
+        """
+        with self.lock:
+            start = self._position_after(after_id) if after_id is not None else 0
+            end = self._position_before(before_id) if before_id is not None else len(self.messages)
+            end = max(start, end)
+            if limit is None or end - start <= limit:
+                has_more = False
+            elif after_id is not None:
+                end = start + limit
+                has_more = True
+            else:
+                start = end - limit
+                has_more = True
+            return [self._copy_dict(message) for message in self.messages[start:end]], has_more
+
+    def changes_since(self, version: int) -> Tuple[List[Dict[str, Any]], List[int]] | None:
+        """
+        The changes after version.
+
+        Returns:
+            The added or edited messages in history order and the ids of the deleted messages, None
+            if the change log does not reach back to version, the client then has to reload the history.
+        """
+        with self.lock:
+            if version > self.version:
+                return None
+            if version < self._changes_floor:
+                return None
+            changed_ids = {message_id for change_version, message_id in self._changes if change_version > version}
+            positions = sorted(self._index[message_id] for message_id in changed_ids if message_id in self._index)
+            deleted_ids = sorted(message_id for message_id in changed_ids if message_id not in self._index)
+            return [self._copy_dict(self.messages[position]) for position in positions], deleted_ids
+
+    @staticmethod
+    def _copy_dict(message: Message) -> Dict[str, Any]:
+        return {"role": message.role, "content": message.content, "id": message.id}
+
+    def _position_before(self, message_id: int) -> int:
+        # Ids increase along the history, ids that are not in the history any more are bisected.
+        index = self._index.get(message_id)
+        if index is not None:
+            return index
+        return bisect.bisect_left(self.messages, message_id, key=lambda message: message.id)
+
+    def _position_after(self, message_id: int) -> int:
+        index = self._index.get(message_id)
+        if index is not None:
+            return index + 1
+        return bisect.bisect_right(self.messages, message_id, key=lambda message: message.id)
+
+    def _record_change(self, *message_ids: int) -> None:
+        self.version += 1
+        for message_id in message_ids:
+            if len(self._changes) == self._changes.maxlen:
+                self._changes_floor = self._changes[0][0]
+            self._changes.append((self.version, message_id))
+
+    def assign_message_ids(self) -> None:
+        """Assign incremental IDs to messages that don't have them."""
+        next_id = 0
+        for message in self.messages:
+            if message.id is None:
+                message.id = next_id
+                next_id += 1
+            else:
+                next_id = max(next_id, message.id + 1)
+        self._rebuild_index()
+
+    def _append(self, message: Message) -> None:
+        self.messages.append(message)
+        if message.id is not None:
+            self._index.setdefault(message.id, len(self.messages) - 1)
+            self.next_message_id = max(self.next_message_id, message.id + 1)
+
+    def _delete_at(self, index: int) -> None:
+        message = self.messages.pop(index)
+        if self._index.get(message.id) == index:
+            del self._index[message.id]
+        # The messages after the deleted one move up by one, this is O(len(messages) - index).
+        for i in range(index, len(self.messages)):
+            message_id = self.messages[i].id
+            if self._index.get(message_id) == i + 1:
+                self._index[message_id] = i
+
+    def _delete_last(self, count: int) -> None:
+        start = len(self.messages) - count
+        for i in range(start, len(self.messages)):
+            message_id = self.messages[i].id
+            if self._index.get(message_id) == i:
+                del self._index[message_id]
+        del self.messages[start:]
+
+    def _rebuild_index(self) -> None:
+        self._index = {}
+        for i, message in enumerate(self.messages):
+            if message.id is not None:
+                self._index.setdefault(message.id, i)
+        self.next_message_id = max(self._index, default=-1) + 1
+
+    def save_history(self, force_checkpoint: bool = False, tags: List[str] = None):
+        """
+        Persist the history.
+
+        Args:
+            force_checkpoint (bool): In journal mode, write a checkpoint even if the journal is not full yet.
+            tags (List[str], optional): Tags stored with the checkpoint in the save manifest.
+        """
+        if self.journal_mode and not force_checkpoint and self.journal_entries < self.compact_every:
+            return
+
+        if not os.path.exists(self.history_folder):
+            os.makedirs(self.history_folder)
+
+        with self.lock:
+            filename = self._new_checkpoint_filename()
+            messages = self.to_list()
+            self._write_atomic(filename, lambda f: json.dump(messages, f))
+            self.manifest.record_checkpoint(filename, messages, tags)
+
+            if self.journal_mode:
+                self._start_journal(filename)
+
+    def _new_checkpoint_filename(self) -> str:
+        # Checkpoints are never overwritten: the journal of an earlier checkpoint with the same
+        # name would be replayed on top of the newer messages after a crash.
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"chat_history_{timestamp}.json"
+        counter = 1
+        while os.path.exists(f"{self.history_folder}/{filename}"):
+            filename = f"chat_history_{timestamp}_{counter}.json"
+            counter += 1
+        return filename
+
+    def _write_atomic(self, filename: str, write) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.history_folder, prefix=".chat_history_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                write(f)
+            os.replace(tmp_path, f"{self.history_folder}/{filename}")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load_history(self):
+        with self.lock:
+            self._load_history()
+            self._rebuild_index()
+            # The loaded history is unrelated to the versions handed out before.
+            self.epoch = uuid.uuid4().hex[:12]
+            self.version = 0
+            self._changes.clear()
+            self._changes_floor = 0
+            self.total_tokens = sum(self.count_tokens(message) for message in self.messages)
+
+    def _load_history(self):
+        if not os.path.exists(self.history_folder):
+            os.makedirs(self.history_folder)
+            print("No chat history found. Starting with an empty history.")
+            self.messages = []
+            return
+
+        journal = self._read_journal()
+        if journal is not None:
+            checkpoint, entries, damaged = journal
+            if damaged:
+                # Appending after a partial line would glue the next entry onto it and hide
+                # every later entry from the replay, so drop the partial line first.
+                self._rewrite_journal(checkpoint, entries)
+            self.journal_checkpoint = checkpoint
+            self._load_snapshot(checkpoint)
+            for entry in entries:
+                self._replay(entry)
+            self.journal_entries = len(entries)
+            self.assign_message_ids()
+            print(f"Replayed {len(entries)} journal entries on top of: {checkpoint or 'empty history'}")
+            if not self.journal_mode:
+                # Journal mode was switched off, keep the journaled changes in a regular checkpoint.
+                if entries:
+                    self.save_history()
+                os.remove(self._journal_path())
+                self.journal_entries = 0
+                self.journal_checkpoint = None
+            return
+
+        latest_history = self.manifest.latest_chat_history
+        if latest_history is not None and not self.manifest.has_file(latest_history):
+            # Files were removed behind our back, fall back to scanning the folder.
+            self.manifest.rebuild()
+            latest_history = self.manifest.latest_chat_history
+
+        if latest_history is None:
+            print("No chat history found. Starting with an empty history.")
+            self.messages = []
+            if self.journal_mode:
+                self._start_journal(None)
+            return
+
+        if self._load_snapshot(latest_history):
+            print(f"Loaded the most recent chat history: {latest_history}")
+        if self.journal_mode:
+            self._start_journal(latest_history)
+
+    def _load_snapshot(self, filename: str | None) -> bool:
+        self.messages = []
+        if filename is None:
+            return False
+        try:
+            with open(f"{self.history_folder}/{filename}", "r") as f:
+                loaded_history = json.load(f)
+                self.messages = [Message(msg['role'], msg['content'], msg.get('id')) for msg in loaded_history]
+            self.assign_message_ids()  # Ensure all messages have IDs
+            return True
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            print(f"Error loading chat history: {e}. Starting with an empty history.")
+            return False
+
+    def _journal_path(self) -> str:
+        return f"{self.history_folder}/{self.JOURNAL_FILE}"
+
+    def _start_journal(self, checkpoint: str | None):
+        with open(self._journal_path(), "w") as f:
+            f.write(json.dumps({"op": "checkpoint", "file": checkpoint}) + "\n")
+        self.journal_entries = 0
+        self.journal_checkpoint = checkpoint
+
+    def _append_journal(self, entry: Dict[str, Any]):
+        if not self.journal_mode:
+            return
+        if not os.path.exists(self.history_folder):
+            os.makedirs(self.history_folder)
+        if not os.path.exists(self._journal_path()):
+            self._start_journal(None)
+        with open(self._journal_path(), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.journal_entries += 1
+
+    def _read_journal(self):
+        # Also read when journal mode is off, the journal may hold changes from a run with journal mode on.
+        if not os.path.exists(self._journal_path()):
+            return None
+
+        with open(self._journal_path(), "r") as f:
+            lines = f.readlines()
+        if not lines:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            return None
+        if header.get("op") != "checkpoint":
+            return None
+
+        entries = []
+        damaged = False
+        for line in lines[1:]:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted append, everything before it is valid.
+                damaged = True
+                break
+            if not line.endswith("\n"):
+                damaged = True
+        return header.get("file"), entries, damaged
+
+    def _rewrite_journal(self, checkpoint: str | None, entries: List[Dict[str, Any]]) -> None:
+        def write(f):
+            f.write(json.dumps({"op": "checkpoint", "file": checkpoint}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+        self._write_atomic(self.JOURNAL_FILE, write)
+
+    def _replay(self, entry: Dict[str, Any]):
+        op = entry.get("op")
+        if op == "add":
+            msg = entry["message"]
+            self._append(Message(msg['role'], msg['content'], msg.get('id')))
+        elif op == "edit":
+            message = self.get_message(entry["id"])
+            if message is not None:
+                message.content = entry["content"]
+        elif op == "delete":
+            index = self._index.get(entry["id"])
+            if index is not None:
+                self._delete_at(index)
+        elif op == "delete_last":
+            self._delete_last(min(entry["count"], len(self.messages)))
@@ -6,6 +6,7 @@ from command_system import CommandSystem
 
 @CommandSystem.command("exit", description="Save the game and exit.")
 def exit_command(vgm) -> Tuple[str, bool]:
+    vgm.wait_for_save_state()
     vgm.save()
     return "Game saved. Goodbye!", True
 
@@ -16,9 +17,38 @@ def save_command(vgm) -> Tuple[str, bool]:
     return "Game saved successfully!", False
 
 
+@CommandSystem.command("prune", description="Delete old chat history and save state files according to the retention policy.")
+def prune_command(vgm) -> Tuple[str, bool]:
+    report = vgm.prune_saves()
+    return str(report), False
+
+
+@CommandSystem.command("stats", description="Display turn timings, token counts and cache statistics.")
+def stats_command(vgm) -> Tuple[str, bool]:
+    stats = vgm.get_stats()
+    output = "Turn phases (process wide):\n"
+    output += "-----------------\n"
+    for phase in stats["phases"]:
+        output += (f"{phase['name']}: {phase['count']} x, mean {phase['mean'] * 1000:.1f} ms, "
+                   f"p50 <= {phase['p50'] * 1000:g} ms, p95 <= {phase['p95'] * 1000:g} ms\n")
+    for kind in stats["tokens"]:
+        output += f"{kind['name']} tokens: {kind['count']} x, mean {kind['mean']:.0f}, p95 <= {kind['p95']:g}\n"
+    prefix_reuse = stats["prefix_reuse"]
+    output += (f"\nPrompt prefix reuse: {prefix_reuse['reused_tokens']}/{prefix_reuse['prompt_tokens']} tokens "
+               f"({prefix_reuse['reuse_ratio']:.0%})\n")
+    token_counter = stats["token_counter"]
+    output += (f"Token counter ({token_counter['tokenizer']}): {token_counter['hits']} hits, "
+               f"{token_counter['misses']} misses\n")
+    if stats["response_cache"] is not None:
+        cache = stats["response_cache"]
+        output += (f"Response cache: {cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries, "
+                   f"{cache['bytes'] / 1024:.1f} KiB\n")
+    return output, False
+
+
 @CommandSystem.command("view_fields", description="Display all template fields and their current values.")
 def view_fields(vgm):
-    fields = vgm.template_fields
+    fields = vgm.game_state.template_fields
     output = "Template Fields:\n"
     output += "-----------------\n"
     for key, value in fields.items():
@@ -28,8 +58,8 @@ def view_fields(vgm):
 
 @CommandSystem.command("edit_field", description="Edit the value of a specific template field.")
 def edit_field(vgm, field_name: str, new_value: str):
-    if field_name in vgm.template_fields:
-        vgm.template_fields[field_name] = new_value
+    if field_name in vgm.game_state.template_fields:
+        vgm.game_state.set_field(field_name, new_value)
         return f"Field '{field_name}' updated successfully.", False
     else:
         return f"Field '{field_name}' not found.", False
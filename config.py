@@ -1,6 +1,6 @@
 import os
 import json
-from typing import Any, Dict
+from typing import Any, Dict, List
 from dotenv import load_dotenv
 
 
@@ -13,9 +13,17 @@ class VirtualGameMasterConfig:
         self.SYSTEM_MESSAGE_FILE: str = ""
         self.SAVE_SYSTEM_MESSAGE_FILE: str = ""
         self.MAX_TOKENS: int = 0
+        self.CONTEXT_SIZE: int = 0
+        self.KEPT_TOKENS: int = 0
+        self.TOKENIZER: str = "approximate"
         self.API_TYPE: str = "openai"
         self.API_KEY: str | None = None
         self.API_URL: str = ""
+        self.API_URLS: str = ""
+        self.BACKEND_ROUTING: str = "least_outstanding"
+        self.BACKEND_MAX_FAILURES: int = 3
+        self.BACKEND_EJECT_SECONDS: float = 30.0
+        self.BACKEND_SLOW_SECONDS: float = 0.0
         self.MODEL: str = ""
         self.TEMPERATURE: float = 0.7
         self.TOP_P: float = 1.0
@@ -24,6 +32,27 @@ class VirtualGameMasterConfig:
         self.TFS_Z: float = 1.0
         self.COMMAND_PREFIX: str = "@"
         self.STOP_SEQUENCES: str = "[]"
+        self.HISTORY_JOURNAL: bool = False
+        self.HISTORY_COMPACT_EVERY: int = 200
+        self.PROMPT_LAYOUT: str = "sliding"
+        self.BACKGROUND_SUMMARIZATION: bool = False
+        self.SUMMARIZE_AHEAD: int = 0
+        self.RESPONSE_CACHE: str = "off"
+        self.RESPONSE_CACHE_FOLDER: str = "response_cache"
+        self.RESPONSE_CACHE_MAX_MB: int = 100
+        self.SESSIONS_FOLDER: str = "chat_history/sessions"
+        self.MAX_SESSIONS: int = 64
+        self.SESSION_IDLE_SECONDS: float = 1800.0
+        self.PROVIDER_POOL_SIZE: int = 8
+        self.LLAMACPP_SLOTS: int = -1
+        self.WS_FLUSH_INTERVAL_MS: int = 25
+        self.WS_FLUSH_BYTES: int = 1024
+        self.WS_SEND_QUEUE_SIZE: int = 32
+        self.RETENTION_AUTO_PRUNE: bool = False
+        self.RETENTION_KEEP_LAST: int = 10
+        self.RETENTION_KEEP_HOURLY: int = 24
+        self.RETENTION_KEEP_DAILY: int = 30
+        self.RETENTION_KEEP_SUMMARIZATION: bool = True
 
     @classmethod
     def from_env(cls, env_file: str = ".env") -> "VirtualGameMasterConfig":
@@ -36,9 +65,17 @@ class VirtualGameMasterConfig:
         config.SYSTEM_MESSAGE_FILE = os.getenv("SYSTEM_MESSAGE_FILE")
         config.SAVE_SYSTEM_MESSAGE_FILE = os.getenv("SAVE_SYSTEM_MESSAGE_FILE")
         config.MAX_TOKENS = int(os.getenv("MAX_TOKENS_PER_RESPONSE"))
+        config.CONTEXT_SIZE = int(os.getenv("CONTEXT_SIZE", 0))
+        config.KEPT_TOKENS = int(os.getenv("KEPT_TOKENS", 0))
+        config.TOKENIZER = os.getenv("TOKENIZER", "approximate").lower()
         config.API_TYPE = os.getenv("API_TYPE", "openai").lower()
         config.API_KEY = os.getenv("API_KEY", None)
         config.API_URL = os.getenv("API_URL")
+        config.API_URLS = os.getenv("API_URLS", "")
+        config.BACKEND_ROUTING = os.getenv("BACKEND_ROUTING", "least_outstanding").lower()
+        config.BACKEND_MAX_FAILURES = int(os.getenv("BACKEND_MAX_FAILURES", 3))
+        config.BACKEND_EJECT_SECONDS = float(os.getenv("BACKEND_EJECT_SECONDS", 30.0))
+        config.BACKEND_SLOW_SECONDS = float(os.getenv("BACKEND_SLOW_SECONDS", 0.0))
         config.MODEL = os.getenv("MODEL")
         config.TEMPERATURE = float(os.getenv("TEMPERATURE", 0.7))
         config.TOP_P = float(os.getenv("TOP_P", 1.0))
@@ -47,6 +84,27 @@ class VirtualGameMasterConfig:
         config.TFS_Z = float(os.getenv("TFS_Z", 1.0))
         config.COMMAND_PREFIX = os.getenv("COMMAND_PREFIX", "@")
         config.STOP_SEQUENCES = os.getenv("STOP_SEQUENCES", "[]")
+        config.HISTORY_JOURNAL = os.getenv("HISTORY_JOURNAL", "false").lower() in ("true", "1", "yes")
+        config.HISTORY_COMPACT_EVERY = int(os.getenv("HISTORY_COMPACT_EVERY", 200))
+        config.PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "sliding").lower()
+        config.BACKGROUND_SUMMARIZATION = os.getenv("BACKGROUND_SUMMARIZATION", "false").lower() in ("true", "1", "yes")
+        config.SUMMARIZE_AHEAD = int(os.getenv("SUMMARIZE_AHEAD", 0))
+        config.RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "off").lower()
+        config.RESPONSE_CACHE_FOLDER = os.getenv("RESPONSE_CACHE_FOLDER", "response_cache")
+        config.RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", 100))
+        config.SESSIONS_FOLDER = os.getenv("SESSIONS_FOLDER", "chat_history/sessions")
+        config.MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 64))
+        config.SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", 1800.0))
+        config.PROVIDER_POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", 8))
+        config.LLAMACPP_SLOTS = int(os.getenv("LLAMACPP_SLOTS", -1))
+        config.WS_FLUSH_INTERVAL_MS = int(os.getenv("WS_FLUSH_INTERVAL_MS", 25))
+        config.WS_FLUSH_BYTES = int(os.getenv("WS_FLUSH_BYTES", 1024))
+        config.WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 32))
+        config.RETENTION_AUTO_PRUNE = os.getenv("RETENTION_AUTO_PRUNE", "false").lower() in ("true", "1", "yes")
+        config.RETENTION_KEEP_LAST = int(os.getenv("RETENTION_KEEP_LAST", 10))
+        config.RETENTION_KEEP_HOURLY = int(os.getenv("RETENTION_KEEP_HOURLY", 24))
+        config.RETENTION_KEEP_DAILY = int(os.getenv("RETENTION_KEEP_DAILY", 30))
+        config.RETENTION_KEEP_SUMMARIZATION = os.getenv("RETENTION_KEEP_SUMMARIZATION", "true").lower() in ("true", "1", "yes")
         return config
 
     @classmethod
@@ -82,4 +140,30 @@ class VirtualGameMasterConfig:
                 setattr(self, key, self._parse_value(key, value))
 
     def to_dict(self) -> Dict[str, Any]:
-        return {key: value for key, value in self.__dict__.items()}
\ No newline at end of file
+        return {key: value for key, value in self.__dict__.items()}
+
+class ConfigReloadReport:
+    """
+    What a configuration change touched.
+
+    Attributes:
+        changed_keys (List[str]): Config keys whose value changed.
+        rebuilt (List[str]): Components that were re-created or re-read.
+        duration (float): Time the reload took in seconds.
+    """
+
+    def __init__(self, changed_keys: List[str]):
+        self.changed_keys = changed_keys
+        self.rebuilt: List[str] = []
+        self.duration = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "changed_keys": self.changed_keys,
+            "rebuilt": self.rebuilt,
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+
+    def __str__(self) -> str:
+        rebuilt = ", ".join(self.rebuilt) or "nothing"
+        return f"Applied {len(self.changed_keys)} changed setting(s), rebuilt {rebuilt} in {self.duration * 1000:.1f} ms."
@@ -1,7 +1,9 @@
+import copy
 import dataclasses
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from pydantic import BaseModel
 from typing import Dict
@@ -12,6 +14,13 @@ from contextlib import asynccontextmanager
 
 from virtual_game_master import VirtualGameMasterConfig, VirtualGameMaster
 from chat_api_selector import VirtualGameMasterChatAPISelector
+from save_manifest import SaveManifest
+from session_manager import SessionManager, GameSession
+from async_streaming import send_coalesced
+from provider_pool import provider_pool
+from backend_router import router_stats
+from metrics import metrics
+from stream_accumulator import StreamAccumulator
 
 
 class ConfigUpdate(BaseModel):
@@ -50,6 +59,9 @@ class TemplateFields(BaseModel):
 @dataclasses.dataclass
 class State:
     rpg_app: VirtualGameMaster
+    sessions: SessionManager
+    # Serializes turns and edits of rpg_app, like GameSession.lock does for a session.
+    lock: asyncio.Lock = dataclasses.field(default_factory=asyncio.Lock)
 
 
 @asynccontextmanager
@@ -58,11 +70,17 @@ async def lifespan(app: FastAPI):
     config = VirtualGameMasterConfig.from_env()
     api_selector = VirtualGameMasterChatAPISelector(config)
     api = api_selector.get_api()
-    app.state = State(rpg_app=VirtualGameMaster(config, api, True))
+    sessions = SessionManager(config, config.SESSIONS_FOLDER, config.MAX_SESSIONS, True)
+    app.state = State(rpg_app=VirtualGameMaster(config, api, True), sessions=sessions)
     app.state.rpg_app.load()
+    idle_eviction = None
+    if config.SESSION_IDLE_SECONDS > 0:
+        idle_eviction = asyncio.create_task(sessions.run_idle_eviction(config.SESSION_IDLE_SECONDS))
     yield
     # Shutdown
-    # Add any cleanup code here if needed
+    if idle_eviction is not None:
+        idle_eviction.cancel()
+    await app.state.sessions.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -78,17 +96,36 @@ app.add_middleware(
 )
 
 
+async def run_turn(rpg_app: VirtualGameMaster, content: str) -> tuple[str, bool]:
+    """Run a turn or command without blocking the event loop and return the complete response."""
+    response, should_exit = await rpg_app.process_input_async(content)
+    if isinstance(response, str):
+        return response, should_exit
+    accumulator = StreamAccumulator()
+    async for chunk in response:
+        accumulator.append(chunk)
+    return accumulator.text(), should_exit
+
+
 @app.post("/api/send_message")
 async def send_message(message: Message):
-    response_generator, should_exit = app.state.rpg_app.process_input(message.content, stream=True)
-    response = "".join(list(response_generator))
+    async with app.state.lock:
+        response, should_exit = await run_turn(app.state.rpg_app, message.content)
     return {"response": response, "should_exit": should_exit}
 
 
+@app.post("/api/send_message_stream")
+async def send_message_stream(message: Message):
+    return StreamingResponse(sse_turn(app.state.rpg_app, message.content, app.state.lock),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.post("/api/edit_message")
 async def edit_message(edit_message: EditMessage):
-    success = app.state.rpg_app.edit_message(edit_message.id, edit_message.content)
-    app.state.rpg_app.save()
+    async with app.state.lock:
+        success = app.state.rpg_app.edit_message(edit_message.id, edit_message.content)
+        await asyncio.to_thread(app.state.rpg_app.save)
     if success:
         return {"status": "success"}
     else:
@@ -102,26 +139,77 @@ async def get_template_fields():
 
 @app.post("/api/update_template_fields")
 async def update_template_fields(fields: TemplateFields):
-    app.state.rpg_app.game_state.template_fields.update(fields.fields)
-    app.state.rpg_app.save()
+    async with app.state.lock:
+        app.state.rpg_app.game_state.update_fields(fields.fields)
+        await asyncio.to_thread(app.state.rpg_app.save)
     return {"status": "success"}
 
 
 @app.post("/api/save_game")
 async def save_game():
-    app.state.rpg_app.save()
+    async with app.state.lock:
+        await asyncio.to_thread(app.state.rpg_app.save)
     return {"status": "success"}
 
 
+@app.post("/api/prune_saves")
+async def prune_saves():
+    report = await asyncio.to_thread(app.state.rpg_app.prune_saves)
+    return {"status": "success", **report.to_dict()}
+
+
+def chat_history_response(rpg_app: VirtualGameMaster, request: Request, before_id: int | None, after_id: int | None,
+                          limit: int | None) -> Response:
+    """
+    A page of the chat history, the complete history without paging parameters.
+
+    The ETag names the history version, a client sending it back in If-None-Match gets an empty 304
+    response as long as the history did not change.
+    """
+    history = rpg_app.history
+    with history.lock:
+        etag = f'"{history.epoch}-{history.version}"'
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        messages, has_more = history.page(before_id, after_id, limit)
+        content = {"history": messages, "has_more": has_more, "next_message_id": rpg_app.next_message_id,
+                   "version": history.version, "epoch": history.epoch}
+    return JSONResponse(content, headers={"ETag": etag})
+
+
+def chat_history_delta(rpg_app: VirtualGameMaster, since: int, epoch: str | None) -> dict:
+    """
+    The messages added or edited and the ids of the messages deleted after version since.
+
+    reset is true if the changes can't be told, because the history was reloaded (the epoch changed)
+    or the version is too old, the client then has to fetch the complete history.
+    """
+    history = rpg_app.history
+    with history.lock:
+        changes = history.changes_since(since) if epoch in (None, history.epoch) else None
+        result = {"version": history.version, "epoch": history.epoch, "next_message_id": rpg_app.next_message_id}
+    if changes is None:
+        return {"reset": True, "messages": [], "deleted_ids": [], **result}
+    messages, deleted_ids = changes
+    return {"reset": False, "messages": messages, "deleted_ids": deleted_ids, **result}
+
+
 @app.get("/api/get_chat_history")
-async def get_chat_history():
-    return {"history": app.state.rpg_app.history.to_list(), "next_message_id": app.state.rpg_app.next_message_id}
+async def get_chat_history(request: Request, before_id: int = None, after_id: int = None,
+                           limit: int = Query(None, ge=1)):
+    return chat_history_response(app.state.rpg_app, request, before_id, after_id, limit)
+
+
+@app.get("/api/get_chat_history_delta")
+async def get_chat_history_delta(since: int, epoch: str = None):
+    return chat_history_delta(app.state.rpg_app, since, epoch)
 
 
 @app.delete("/api/delete_message/{msg_id}")
 async def get_delete_message(msg_id: int):
-    result = app.state.rpg_app.history.delete_message(msg_id)
-    app.state.rpg_app.save()
+    async with app.state.lock:
+        result = app.state.rpg_app.history.delete_message(msg_id)
+        await asyncio.to_thread(app.state.rpg_app.save)
     if result:
         return {"status": "success", "next_message_id": app.state.rpg_app.next_message_id}
     else:
@@ -144,30 +232,24 @@ async def get_config():
 @app.post("/api/update_config")
 async def update_config(config_update: ConfigUpdate):
     try:
-
-        app.state.rpg_app.config.update(config_update.to_dict())
-        config = app.state.rpg_app.config
-        api_selector = VirtualGameMasterChatAPISelector(config)
-        api = api_selector.get_api()
-        app.state = State(rpg_app=VirtualGameMaster(config, api))
-        app.state.rpg_app.load()
-        return {"status": "success"}
+        async with app.state.lock:
+            report = await asyncio.to_thread(app.state.rpg_app.apply_config, config_update.to_dict())
+        return {"status": "success", "reload": report.to_dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/save_config")
 async def save_config(config_update: ConfigUpdate):
     try:
-
-        app.state.rpg_app.config.update(config_update.to_dict())
-        app.state.rpg_app.config.to_env()
+        # The running config is changed by apply_config, which compares it to the saved values.
+        saved_config = copy.copy(app.state.rpg_app.config)
+        saved_config.update(config_update.to_dict())
+        saved_config.to_env()
 
         config = VirtualGameMasterConfig.from_env()
-        api_selector = VirtualGameMasterChatAPISelector(config)
-        api = api_selector.get_api()
-        app.state = State(rpg_app=VirtualGameMaster(config, api))
-        app.state.rpg_app.load()
-        return {"status": "success"}
+        async with app.state.lock:
+            report = await asyncio.to_thread(app.state.rpg_app.apply_config, config.to_dict())
+        return {"status": "success", "reload": report.to_dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -175,8 +257,16 @@ async def save_config(config_update: ConfigUpdate):
 @app.get("/api/get_chat_history_folders")
 async def get_chat_history_folders():
     chat_history_path = os.path.join(os.path.dirname(__file__), "chat_history")
-    folders = [os.path.join("chat_history", f) for f in os.listdir(chat_history_path) if os.path.isdir(os.path.join(chat_history_path, f))]
-    return {"folders": folders, "active": os.path.join("chat_history", os.path.basename(app.state.rpg_app.config.GAME_SAVE_FOLDER))}
+    sessions_folder = os.path.normpath(app.state.rpg_app.config.SESSIONS_FOLDER)
+    folders = [os.path.join("chat_history", f) for f in os.listdir(chat_history_path)
+               if os.path.isdir(os.path.join(chat_history_path, f))
+               and os.path.normpath(os.path.join("chat_history", f)) != sessions_folder]
+    metadata = {}
+    for folder in folders:
+        manifest_data = SaveManifest.read(os.path.join(os.path.dirname(__file__), folder))
+        if manifest_data is not None:
+            metadata[folder] = SaveManifest.summarize(manifest_data)
+    return {"folders": folders, "metadata": metadata, "active": os.path.join("chat_history", os.path.basename(app.state.rpg_app.config.GAME_SAVE_FOLDER))}
 
 
 @app.get("/api/get_game_starters")
@@ -207,25 +297,192 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
-            response_generator, should_exit = app.state.rpg_app.process_input(message['content'], stream=True)
-
-            async for chunk in async_generator(response_generator):
-                await websocket.send_text(json.dumps({"type": "chunk", "content": chunk}))
-                await asyncio.sleep(0)  # Allow other tasks to run
-
-            await websocket.send_text(json.dumps(
-                {"type": "end", "should_exit": should_exit, "next_message_id": app.state.rpg_app.next_message_id}))
-
+            async with app.state.lock:
+                should_exit = await stream_turn(websocket, app.state.rpg_app, message['content'])
             if should_exit:
                 break
     except WebSocketDisconnect:
         print("WebSocket disconnected")
 
 
-async def async_generator(sync_generator):
-    for item in sync_generator:
-        yield item
-        await asyncio.sleep(0)  # Allow other tasks to run
+async def stream_turn(websocket: WebSocket, rpg_app: VirtualGameMaster, content: str) -> bool:
+    """
+    Stream one turn to a WebSocket. Provider chunks are coalesced into chunk frames as configured by
+    WS_FLUSH_INTERVAL_MS and WS_FLUSH_BYTES, the end frame reports how many frames were sent.
+    """
+    response, should_exit = await rpg_app.process_input_async(content)
+
+    async def send_chunk(text: str):
+        await websocket.send_text(json.dumps({"type": "chunk", "content": text}))
+
+    if isinstance(response, str):
+        await send_chunk(response)
+        stats = {"chunks_received": 1, "frames_sent": 1, "bytes_sent": len(response)}
+    else:
+        config = rpg_app.config
+        stats = (await send_coalesced(response, send_chunk, flush_interval=config.WS_FLUSH_INTERVAL_MS / 1000,
+                                      flush_bytes=config.WS_FLUSH_BYTES,
+                                      max_queued_frames=config.WS_SEND_QUEUE_SIZE)).to_dict()
+
+    await websocket.send_text(json.dumps(
+        {"type": "end", "should_exit": should_exit, "next_message_id": rpg_app.next_message_id, "stats": stats}))
+    return should_exit
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def sse_turn(rpg_app: VirtualGameMaster, content: str, lock: asyncio.Lock = None):
+    """
+    Server-Sent Events of one turn: a chunk event per provider chunk and a final end event
+    with time to first token and tokens per second of the response.
+    """
+    if lock is not None:
+        await lock.acquire()
+    try:
+        accumulator = StreamAccumulator(rpg_app.token_counter)
+        response, should_exit = await rpg_app.process_input_async(content)
+
+        if isinstance(response, str):
+            accumulator.append(response)
+            yield sse_event("chunk", {"content": response})
+        else:
+            async for chunk in response:
+                accumulator.append(chunk)
+                yield sse_event("chunk", {"content": chunk})
+
+        accumulator.finish()
+        tokens = accumulator.tokens
+        stream_duration = accumulator.stream_duration or 0.0
+        yield sse_event("end", {
+            "should_exit": should_exit,
+            "next_message_id": rpg_app.next_message_id,
+            "time_to_first_token": accumulator.time_to_first_chunk,
+            "total_time": accumulator.end_time - accumulator.start_time,
+            "tokens": tokens,
+            "tokens_per_second": tokens / stream_duration if stream_duration > 0 else None,
+        })
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+async def get_session(session_id: str) -> GameSession:
+    try:
+        return await app.state.sessions.get(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/sessions")
+async def list_sessions():
+    return {"sessions": app.state.sessions.list_sessions()}
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/provider_pool")
+async def get_provider_pool_stats():
+    return {"backends": provider_pool.stats(), "routers": router_stats()}
+
+
+@app.post("/api/sessions/{session_id}/send_message")
+async def session_send_message(session_id: str, message: Message):
+    session = await get_session(session_id)
+    async with session.lock:
+        response, should_exit = await run_turn(session.vgm, message.content)
+    return {"response": response, "should_exit": should_exit}
+
+
+@app.post("/api/sessions/{session_id}/send_message_stream")
+async def session_send_message_stream(session_id: str, message: Message):
+    session = await get_session(session_id)
+    return StreamingResponse(sse_turn(session.vgm, message.content, session.lock), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/sessions/{session_id}/edit_message")
+async def session_edit_message(session_id: str, edit_message: EditMessage):
+    session = await get_session(session_id)
+    async with session.lock:
+        success = session.vgm.edit_message(edit_message.id, edit_message.content)
+        await asyncio.to_thread(session.vgm.save)
+    if success:
+        return {"status": "success"}
+    else:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+
+@app.delete("/api/sessions/{session_id}/delete_message/{msg_id}")
+async def session_delete_message(session_id: str, msg_id: int):
+    session = await get_session(session_id)
+    async with session.lock:
+        result = session.vgm.history.delete_message(msg_id)
+        await asyncio.to_thread(session.vgm.save)
+    if result:
+        return {"status": "success", "next_message_id": session.vgm.next_message_id}
+    else:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+
+@app.get("/api/sessions/{session_id}/get_chat_history")
+async def session_get_chat_history(session_id: str, request: Request, before_id: int = None, after_id: int = None,
+                                   limit: int = Query(None, ge=1)):
+    session = await get_session(session_id)
+    return chat_history_response(session.vgm, request, before_id, after_id, limit)
+
+
+@app.get("/api/sessions/{session_id}/get_chat_history_delta")
+async def session_get_chat_history_delta(session_id: str, since: int, epoch: str = None):
+    session = await get_session(session_id)
+    return chat_history_delta(session.vgm, since, epoch)
+
+
+@app.get("/api/sessions/{session_id}/get_template_fields")
+async def session_get_template_fields(session_id: str):
+    session = await get_session(session_id)
+    return {"fields": session.vgm.game_state.template_fields}
+
+
+@app.post("/api/sessions/{session_id}/update_template_fields")
+async def session_update_template_fields(session_id: str, fields: TemplateFields):
+    session = await get_session(session_id)
+    async with session.lock:
+        session.vgm.game_state.update_fields(fields.fields)
+        await asyncio.to_thread(session.vgm.save)
+    return {"status": "success"}
+
+
+@app.post("/api/sessions/{session_id}/save_game")
+async def session_save_game(session_id: str):
+    session = await get_session(session_id)
+    async with session.lock:
+        await asyncio.to_thread(session.vgm.save)
+    return {"status": "success"}
+
+
+@app.websocket("/ws/{session_id}")
+async def session_websocket_endpoint(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_text()
+            message = json.loads(data)
+            try:
+                session = await app.state.sessions.get(session_id)
+            except ValueError as e:
+                await websocket.close(code=1008, reason=str(e))
+                break
+            async with session.lock:
+                should_exit = await stream_turn(websocket, session.vgm, message['content'])
+            if should_exit:
+                break
+    except WebSocketDisconnect:
+        print(f"WebSocket of session {session_id} disconnected")
 
 
 if __name__ == "__main__":
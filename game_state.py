@@ -7,8 +7,29 @@ from typing import Dict, Any
 
 
 class GameState:
+    """
+    Game state stored as template fields.
+
+    Every change of the fields through the methods of this class, or by assigning template_fields,
+    increments version, so rendered prompts can be cached per version. Code mutating the
+    template_fields dictionary directly has to call bump_version itself.
+    """
+
     def __init__(self, initial_state_file: str):
-        self.template_fields = self.load_yaml_initial_game_state(initial_state_file)
+        self.version = 0
+        self._template_fields = self.load_yaml_initial_game_state(initial_state_file)
+
+    @property
+    def template_fields(self) -> Dict[str, Any]:
+        return self._template_fields
+
+    @template_fields.setter
+    def template_fields(self, template_fields: Dict[str, Any]) -> None:
+        self._template_fields = template_fields
+        self.bump_version()
+
+    def bump_version(self) -> None:
+        self.version += 1
 
     def load_yaml_initial_game_state(self, file_path: str) -> Dict[str, Any]:
         if not os.path.exists(file_path):
@@ -76,26 +97,32 @@ class GameState:
         return '\n'.join(result)
 
     def update_from_xml(self, xml_string: str) -> None:
+        self.update_fields(self.parse_xml_update(xml_string))
+
+    def parse_xml_update(self, xml_string: str) -> Dict[str, str]:
+        """Parse a game state update into the changed fields, without applying it."""
         xml_string = f"<root>{xml_string}</root>"
+        updates = {}
         try:
             root = ET.fromstring(xml_string)
-            self._process_element(root)
+            self._process_element(root, updates)
         except ET.ParseError:
-            self._update_from_regex(xml_string)
+            self._update_from_regex(xml_string, updates)
+        return updates
 
-    def _process_element(self, element: ET.Element) -> None:
+    def _process_element(self, element: ET.Element, updates: Dict[str, str]) -> None:
         for child in element:
             if len(child) == 0:  # If the element has no children
                 key = child.tag.split('.')[-1]
-                self.template_fields[key] = child.text.strip() if child.text else ""
+                updates[key] = child.text.strip() if child.text else ""
             else:
-                self._process_element(child)
+                self._process_element(child, updates)
 
-    def _update_from_regex(self, content: str) -> None:
+    def _update_from_regex(self, content: str, updates: Dict[str, str]) -> None:
         sections = re.findall(r'<([\w.]+)>(.*?)</\1>', content, re.DOTALL)
         for section, content in sections:
             key = section.split('.')[-1]
-            self.template_fields[key] = content.strip()
+            updates[key] = content.strip()
 
     def save_json(self, filename: str) -> None:
         with open(filename, "w") as f:
@@ -110,6 +137,11 @@ class GameState:
 
     def set_field(self, key: str, value: Any) -> None:
         self.template_fields[key] = value
+        self.bump_version()
+
+    def update_fields(self, fields: Dict[str, Any]) -> None:
+        # Copy on write, so readers on other threads never see a partially applied update.
+        self.template_fields = {**self.template_fields, **fields}
 
     def __str__(self) -> str:
         return f"GameState(fields: {len(self.template_fields)})"
@@ -0,0 +1,77 @@
+import threading
+from typing import Any, Dict, Optional
+
+
+class LlamaCppSlots:
+    """
+    Assigns the requests to a llama.cpp server to its parallel slots.
+
+    The server batches the requests running in its slots (continuous batching), so it can serve
+    as many concurrent requests as it has slots. Each slot keeps the KV cache of its last prompt,
+    so a game master is sent to the slot it used before whenever that slot is free, and only moves
+    to another free slot when it is busy.
+
+    Attributes:
+        slot_count (int): Number of parallel slots of the server.
+        sticky_hits (int): Requests that got the slot they asked for.
+        slot_switches (int): Requests that had to use another slot.
+    """
+
+    def __init__(self, slot_count: int):
+        self.slot_count = slot_count
+        self.sticky_hits = 0
+        self.slot_switches = 0
+        self._busy = set()
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, preferred: Optional[int] = None) -> int:
+        """
+        Reserve a slot. The caller has to limit the concurrent requests to slot_count.
+
+        Args:
+            preferred (Optional[int]): Slot used by the previous request of the game master.
+
+        Returns:
+            int: Id of the reserved slot.
+        """
+        with self._lock:
+            if preferred is not None and preferred not in self._busy:
+                self.sticky_hits += 1
+                slot = preferred
+            else:
+                if preferred is not None:
+                    self.slot_switches += 1
+                # New game masters are spread over the slots round robin.
+                slot = next(s % self.slot_count for s in range(self._next_slot, self._next_slot + self.slot_count)
+                            if s % self.slot_count not in self._busy)
+                self._next_slot = slot + 1
+            self._busy.add(slot)
+            return slot
+
+    def release(self, slot: int) -> None:
+        with self._lock:
+            self._busy.discard(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slot_count": self.slot_count,
+                "busy_slots": len(self._busy),
+                "sticky_hits": self.sticky_hits,
+                "slot_switches": self.slot_switches,
+            }
+
+
+def detect_llama_cpp_slots(api_url: str, api_key: Optional[str]) -> Optional[int]:
+    """Number of parallel slots reported by the /props endpoint of a llama.cpp server, None if unavailable."""
+    import requests
+
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        response = requests.get(f"{api_url.rstrip('/')}/props", headers=headers, timeout=5)
+        response.raise_for_status()
+        slots = int(response.json()["total_slots"])
+    except (requests.RequestException, KeyError, TypeError, ValueError):
+        return None
+    return slots if slots > 0 else None
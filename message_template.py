@@ -1,5 +1,7 @@
 import re
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, List, Tuple
+
+_PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
 
 
 class MessageTemplate:
@@ -18,6 +20,11 @@ class MessageTemplate:
 
     Attributes:
         template (str): The template string containing placeholders.
+
+    The template is compiled once on creation into a list of segments. Consecutive lines without
+    placeholders are merged into a single literal string, lines with placeholders are stored as
+    tuples alternating literal text and placeholder names. Rendering only fills in the placeholder
+    lines and joins the segments.
     """
 
     def __init__(self, template_file=None, template_string=None):
@@ -37,6 +44,7 @@ class MessageTemplate:
             raise ValueError(
                 "Either 'template_file' or 'template_string' must be provided"
             )
+        self._segments = self._compile(self.template)
 
     @classmethod
     def from_string(cls, template_string):
@@ -66,6 +74,33 @@ class MessageTemplate:
             template_string = file.read()
         return cls(template_string=template_string)
 
+    @staticmethod
+    def _compile(template: str) -> List[Union[str, Tuple[str, ...]]]:
+        """
+        Compile the template into segments, one segment per placeholder line and one per run of literal lines.
+
+        Args:
+            template (str): The template string.
+
+        Returns:
+            List[Union[str, Tuple[str, ...]]]: The segments, joined by newlines they form the template.
+        """
+        segments = []
+        literal_lines = []
+        for line in template.split('\n'):
+            # Splitting on the capturing pattern yields literal, name, literal, name, ..., literal.
+            parts = _PLACEHOLDER_PATTERN.split(line)
+            if len(parts) == 1:
+                literal_lines.append(line)
+                continue
+            if literal_lines:
+                segments.append('\n'.join(literal_lines))
+                literal_lines = []
+            segments.append(tuple(parts))
+        if literal_lines:
+            segments.append('\n'.join(literal_lines))
+        return segments
+
     def _remove_empty_placeholders(self, text):
         """
         Remove lines that contain only the empty placeholder.
@@ -74,7 +109,7 @@ class MessageTemplate:
             text (str): The text containing placeholders.
 
         Returns:
-            str: Text with empty placeholders removed.
+            List[str]: The remaining lines, with empty placeholders removed.
         """
         lines = text.split('\n')
         processed_lines = []
@@ -85,7 +120,7 @@ class MessageTemplate:
                     processed_lines.append(new_line)
             else:
                 processed_lines.append(line)
-        return '\n'.join(processed_lines)
+        return processed_lines
 
     def generate_message_content(
             self,
@@ -112,26 +147,31 @@ class MessageTemplate:
             for key, value in all_fields.items()
         }
 
-        if not remove_empty_template_field:
-            def replace_placeholder(match):
-                placeholder = match.group(1)
-                return cleaned_fields.get(placeholder, match.group(0))
-
-            prompt = re.sub(r"\{(\w+)\}", replace_placeholder, self.template)
-            return prompt
-
-        def replace_placeholder(match):
-            placeholder = match.group(1)
-            k = cleaned_fields.get(placeholder, None)
-            if k != None:
-                return cleaned_fields.get(placeholder, match.group(0))
-            return "__EMPTY_TEMPLATE_FIELD__"
-
-        # Initial placeholder replacement
-        prompt = re.sub(r"\{(\w+)\}", replace_placeholder, self.template)
-
-        return self._remove_empty_placeholders(prompt)
-
-
-
-
+        output = []
+        for segment in self._segments:
+            if isinstance(segment, str):
+                output.append(segment)
+                continue
+
+            pieces = list(segment)
+            has_empty_field = False
+            for i in range(1, len(pieces), 2):
+                value = cleaned_fields.get(pieces[i])
+                if value is not None:
+                    pieces[i] = value
+                elif remove_empty_template_field:
+                    pieces[i] = "__EMPTY_TEMPLATE_FIELD__"
+                    has_empty_field = True
+                else:
+                    pieces[i] = "{" + pieces[i] + "}"
+            line = "".join(pieces)
+
+            if has_empty_field:
+                # Field values can span lines, so filter the lines the placeholder line expanded to.
+                lines = self._remove_empty_placeholders(line)
+                if not lines:
+                    continue
+                line = '\n'.join(lines)
+            output.append(line)
+
+        return '\n'.join(output)
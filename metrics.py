@@ -0,0 +1,105 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense: counts per upper bound, plus sum and count."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, the largest bound for the overflow bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Process wide timings and token counts of the game masters.
+
+    Histograms are grouped in families, each family has one histogram per label value, e.g. the
+    "vgm_phase_seconds" family has one histogram per phase of a turn.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+        self.define("vgm_phase_seconds", "phase", "Duration of the phases of a game master turn in seconds.",
+                    LATENCY_BUCKETS)
+        self.define("vgm_tokens", "kind", "Prompt and response tokens per request.", TOKEN_BUCKETS)
+
+    def define(self, family: str, label: str, description: str, buckets: Tuple[float, ...]) -> None:
+        with self._lock:
+            self._families[family] = (label, description, buckets)
+
+    def observe(self, family: str, label_value: str, value: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get((family, label_value))
+            if histogram is None:
+                histogram = Histogram(self._families[family][2])
+                self._histograms[(family, label_value)] = histogram
+            histogram.observe(value)
+
+    def observe_phase(self, phase: str, seconds: float) -> None:
+        self.observe("vgm_phase_seconds", phase, seconds)
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        """Time the enclosed block as a phase, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    def summary(self, family: str = "vgm_phase_seconds") -> List[Dict[str, float | str]]:
+        with self._lock:
+            return [{"name": label_value, "count": histogram.count,
+                     "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                     "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95)}
+                    for (name, label_value), histogram in sorted(self._histograms.items()) if name == family]
+
+    def render_prometheus(self) -> str:
+        """All histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for family, (label, description, _) in self._families.items():
+                lines.append(f"# HELP {family} {description}")
+                lines.append(f"# TYPE {family} histogram")
+                for (name, label_value), histogram in sorted(self._histograms.items()):
+                    if name != family:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                        cumulative += count
+                        lines.append(f'{family}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{family}_bucket{{{label}="{label_value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{family}_sum{{{label}="{label_value}"}} {histogram.sum}')
+                    lines.append(f'{family}_count{{{label}="{label_value}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
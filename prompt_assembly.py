@@ -0,0 +1,195 @@
+from typing import Callable, Dict, Any, List, Sequence, Tuple
+
+from token_counter import TokenCounter
+
+
+class PrefixReuseStats:
+    """
+    How much of a request matches the beginning of the previous request byte for byte.
+
+    Providers with prompt caching (llama.cpp KV cache, Anthropic prompt caching) can only reuse this prefix.
+    """
+
+    def __init__(self, reused_messages: int = 0, reused_tokens: int = 0, prompt_tokens: int = 0):
+        self.reused_messages = reused_messages
+        self.reused_tokens = reused_tokens
+        self.prompt_tokens = prompt_tokens
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "reused_messages": self.reused_messages,
+            "reused_tokens": self.reused_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "reuse_ratio": self.reuse_ratio,
+        }
+
+    def __str__(self) -> str:
+        return f"{self.reused_tokens}/{self.prompt_tokens} prompt tokens reusable ({self.reuse_ratio:.0%})"
+
+
+class PromptAssembler:
+    """
+    Assembles the messages sent to the provider: the system message followed by the history window.
+
+    In the "sliding" layout every request is the current system message followed by the history
+    from the window start, so each game state update rewrites the start of the request.
+
+    The "prefix_stable" layout pins the system message and the history from the window start of
+    the pin, and only appends to them. When the game state changes, the system message is not
+    re-rendered: the changed part of the new system message is put in front of the user message of
+    that turn as a game state update, and stays there in the following requests. Messages that
+    summarization moves out of the window also stay. Only when the request outgrows token_limit or
+    message_limit, the history changed in front of the pinned block, or the assembler is reset, the
+    request is re-pinned to the current system message and window.
+
+    Both layouts measure how many leading tokens of each request match the previous request. Token
+    counts of fully reused messages come from the token counter, a partially reused message counts
+    four characters per token.
+    """
+    LAYOUTS = ("sliding", "prefix_stable")
+    STATE_UPDATE_HEADER = "[Game state update]"
+
+    def __init__(self, layout: str = "sliding", token_counter: TokenCounter = None):
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Unsupported prompt layout: {layout}")
+        self.layout = layout
+        self.token_counter = token_counter or TokenCounter()
+        self.last_stats = PrefixReuseStats()
+        self.total_reused_tokens = 0
+        self.total_prompt_tokens = 0
+        self._pinned_system_message: str | None = None
+        self._pinned_offset: int | None = None
+        self._pinned_id: int | None = None
+        self._current_system_message: str | None = None
+        # Game state updates by the id of the user message they are put in front of.
+        self._state_updates: Dict[int, str] = {}
+        # Role and content of the previous request messages, kept apart from the dicts sent to the provider.
+        self._last_request: List[Tuple[str, str]] = []
+
+    def assemble(self, system_message: Callable[[], str], window_start: int, history: Sequence[Dict[str, Any]],
+                 token_limit: int = None, message_limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Build the request messages and measure the prefix shared with the previous request.
+
+        Args:
+            system_message (Callable[[], str]): Renders the current system message.
+            window_start (int): Index of the first history message of the window.
+            history (Sequence[Dict[str, Any]]): The complete history, e.g. a HistoryView, ending with the
+                user message of this turn.
+            token_limit (int, optional): Maximum prompt tokens of a "prefix_stable" request.
+            message_limit (int, optional): Maximum history messages of a "prefix_stable" request.
+
+        Returns:
+            List[Dict[str, Any]]: The request messages, new dicts the caller and the provider may modify.
+        """
+        if self.layout == "sliding":
+            request = [{"role": "system", "content": system_message()}]
+            # The history dicts are shared with the messages, see Message.to_dict.
+            request.extend(dict(message) for message in history[window_start:])
+        else:
+            request = self._assemble_prefix_stable(system_message(), window_start, history, token_limit,
+                                                   message_limit)
+
+        self.last_stats = self._measure_prefix_reuse(request)
+        self.total_reused_tokens += self.last_stats.reused_tokens
+        self.total_prompt_tokens += self.last_stats.prompt_tokens
+        self._last_request = [(message["role"], message["content"]) for message in request]
+        return request
+
+    def reset(self) -> None:
+        """Drop the pinned system message and history block, the next request re-pins them."""
+        self._pinned_system_message = None
+        self._pinned_offset = None
+        self._pinned_id = None
+        self._current_system_message = None
+        self._state_updates = {}
+
+    def _assemble_prefix_stable(self, system_message: str, window_start: int, history: Sequence[Dict[str, Any]],
+                                token_limit: int | None, message_limit: int | None) -> List[Dict[str, Any]]:
+        if not self._is_pin_valid(window_start, history):
+            self._pin(system_message, window_start, history)
+        elif system_message != self._current_system_message and len(history) > 0:
+            self._current_system_message = system_message
+            self._state_updates[history[-1]["id"]] = self._state_update(system_message)
+
+        request = self._build_pinned_request(history)
+        if request is None or (self._pinned_offset < window_start
+                               and self._is_too_large(request, token_limit, message_limit)):
+            self._pin(system_message, window_start, history)
+            request = self._build_pinned_request(history)
+        return request
+
+    def _is_pin_valid(self, window_start: int, history: Sequence[Dict[str, Any]]) -> bool:
+        # The pinned block has to start at the same message, otherwise messages in front of it were deleted.
+        return (self._pinned_system_message is not None and self._pinned_offset <= window_start
+                and self._pinned_offset < len(history) and history[self._pinned_offset]["id"] == self._pinned_id)
+
+    def _pin(self, system_message: str, window_start: int, history: Sequence[Dict[str, Any]]) -> None:
+        self._pinned_system_message = system_message
+        self._current_system_message = system_message
+        self._pinned_offset = window_start
+        self._pinned_id = history[window_start]["id"] if window_start < len(history) else None
+        self._state_updates = {}
+
+    def _state_update(self, system_message: str) -> str:
+        # The new system message from the paragraph that first differs from the pinned one, so the
+        # update starts with the heading of the changed section.
+        common = 0
+        for a, b in zip(self._pinned_system_message, system_message):
+            if a != b:
+                break
+            common += 1
+        paragraph_start = system_message.rfind("\n\n", 0, common)
+        paragraph_start = paragraph_start + 2 if paragraph_start >= 0 else 0
+        return f"{self.STATE_UPDATE_HEADER}\n{system_message[paragraph_start:]}"
+
+    def _build_pinned_request(self, history: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]] | None:
+        """The pinned request, None if a message carrying a game state update was deleted."""
+        request = [{"role": "system", "content": self._pinned_system_message}]
+        updates = 0
+        for message in history[self._pinned_offset:]:
+            update = self._state_updates.get(message["id"])
+            if update is not None:
+                message = {**message, "content": f"{update}\n\n{message['content']}"}
+                updates += 1
+            else:
+                message = dict(message)
+            request.append(message)
+        return request if updates == len(self._state_updates) else None
+
+    def _is_too_large(self, request: List[Dict[str, Any]], token_limit: int | None, message_limit: int | None) -> bool:
+        if message_limit is not None and len(request) - 1 > message_limit:
+            return True
+        if token_limit is not None:
+            return sum(self.token_counter.count(message["content"]) for message in request) > token_limit
+        return False
+
+    def _measure_prefix_reuse(self, request: List[Dict[str, Any]]) -> PrefixReuseStats:
+        stats = PrefixReuseStats()
+        prefix_intact = True
+        for i, message in enumerate(request):
+            content = message["content"]
+            tokens = self.token_counter.count(content)
+            stats.prompt_tokens += tokens
+            if not prefix_intact:
+                continue
+
+            previous = self._last_request[i] if i < len(self._last_request) else None
+            if previous is not None and previous == (message["role"], content):
+                stats.reused_messages += 1
+                stats.reused_tokens += tokens
+                continue
+
+            prefix_intact = False
+            if previous is not None and previous[0] == message["role"]:
+                common = 0
+                for a, b in zip(previous[1], content):
+                    if a != b:
+                        break
+                    common += 1
+                stats.reused_tokens += common // 4
+        return stats
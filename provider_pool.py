@@ -0,0 +1,219 @@
+import copy
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, List, Tuple
+
+from chat_api import ChatAPI
+from llama_cpp_slots import LlamaCppSlots
+
+PoolKey = Tuple[str, str | None, str | None, str | None]
+
+
+class ProviderPoolEntry:
+    """
+    Provider clients of one backend, shared by all game masters using the same backend.
+
+    A client is only used by one request at a time, so each request can set its own sampling
+    settings on it. Clients are created on demand, up to max_concurrency, and kept for later
+    requests together with their HTTP connection pools.
+
+    Attributes:
+        key (PoolKey): API type, URL, key and model of the backend.
+        max_concurrency (int): Maximum number of concurrent requests to the backend.
+        clients_created (int): Number of provider clients created.
+        requests (int): Number of requests started.
+        errors (int): Number of requests that failed.
+        in_flight (int): Number of requests running.
+        total_wait_time (float): Seconds requests waited for a free client.
+        slots (LlamaCppSlots | None): Slot assignment of a llama.cpp backend, the concurrency limit
+            is then the number of slots. Only used if the settings of the provider accept extra request
+            parameters through set_extra_request_kwargs, otherwise requests can't be pinned to a slot.
+    """
+
+    def __init__(self, key: PoolKey, factory: Callable[[], ChatAPI], max_concurrency: int,
+                 slots: LlamaCppSlots | None = None):
+        self.key = key
+        self.clients_created = 0
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_wait_time = 0.0
+        self._factory = factory
+        self._idle: List[ChatAPI] = []
+        self._lock = threading.Lock()
+        client = self._create_client()
+        self._idle.append(client)
+        self.settings_template = copy.deepcopy(client.settings)
+        if slots is not None and not hasattr(self.settings_template, "set_extra_request_kwargs"):
+            print(f"The provider of {key[1]} can't send a slot id, requests are not pinned to slots")
+            slots = None
+        self.slots = slots
+        if slots is not None:
+            max_concurrency = slots.slot_count
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def acquire(self) -> ChatAPI:
+        start = time.perf_counter()
+        self._slots.acquire()
+        with self._lock:
+            self.total_wait_time += time.perf_counter() - start
+            self.requests += 1
+            self.in_flight += 1
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return self._create_client()
+        except BaseException:
+            self.release(None, failed=True)
+            raise
+
+    def release(self, client: ChatAPI | None, failed: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+            if client is not None:
+                self._idle.append(client)
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        slots = self.slots.stats() if self.slots is not None else None
+        with self._lock:
+            return {
+                "api_type": self.key[0],
+                "api_url": self.key[1],
+                "model": self.key[3],
+                "max_concurrency": self.max_concurrency,
+                "clients_created": self.clients_created,
+                "idle_clients": len(self._idle),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "average_wait_ms": self.total_wait_time / self.requests * 1000 if self.requests else 0.0,
+                "slots": slots,
+            }
+
+    def _create_client(self) -> ChatAPI:
+        client = self._factory()
+        with self._lock:
+            self.clients_created += 1
+        return client
+
+
+class PooledChatAPI:
+    """
+    Chat API of one game master backed by a shared provider pool entry.
+
+    It has its own settings, which are set on the pooled client for the duration of each request,
+    and otherwise behaves like the provider it wraps. On llama.cpp backends with slots, each request
+    is pinned to a slot, preferably the one of the previous request so its cached prompt is reused.
+    """
+
+    def __init__(self, entry: ProviderPoolEntry):
+        self.entry = entry
+        self.settings = copy.deepcopy(entry.settings_template)
+        self.slot: int | None = None
+
+    def get_current_settings(self):
+        return self.settings
+
+    def get_response(self, messages: List[Dict[str, Any]]) -> str:
+        client = self.entry.acquire()
+        slot = self._acquire_slot()
+        failed = False
+        try:
+            client.settings = self._request_settings(slot)
+            return client.get_response(messages)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._release_slot(slot)
+            self.entry.release(client, failed)
+
+    def get_streaming_response(self, messages: List[Dict[str, Any]]) -> Generator[str, None, None]:
+        # The client is held until the stream is exhausted or closed.
+        client = self.entry.acquire()
+        slot = self._acquire_slot()
+        failed = False
+        try:
+            client.settings = self._request_settings(slot)
+            yield from client.get_streaming_response(messages)
+        except GeneratorExit:
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._release_slot(slot)
+            self.entry.release(client, failed)
+
+    def _request_settings(self, slot: int | None):
+        if slot is None:
+            return self.settings
+        # A copy, so concurrent requests of the same game master keep their own slot.
+        settings = copy.deepcopy(self.settings)
+        # The llama.cpp provider adds extra request kwargs to the body of its /completion request.
+        settings.set_extra_request_kwargs(id_slot=slot, cache_prompt=True)
+        return settings
+
+    def _acquire_slot(self) -> int | None:
+        if self.entry.slots is None:
+            return None
+        slot = self.entry.slots.acquire(self.slot)
+        self.slot = slot
+        return slot
+
+    def _release_slot(self, slot: int | None) -> None:
+        if slot is not None:
+            self.entry.slots.release(slot)
+
+
+class ProviderPool:
+    """
+    Process wide registry of provider clients keyed by (API_TYPE, API_URL, API_KEY, MODEL).
+
+    Game masters of the same backend share its clients and their keep-alive connections instead
+    of each creating a new client on every config update or session.
+    """
+
+    def __init__(self):
+        self._entries: Dict[PoolKey, ProviderPoolEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: PoolKey, factory: Callable[[], ChatAPI], max_concurrency: int,
+            slot_count: Callable[[], int | None] = None) -> PooledChatAPI:
+        """
+        Get a chat API backed by the pool entry of a backend, creating the entry on first use.
+
+        Args:
+            key (PoolKey): API type, URL, key and model of the backend.
+            factory (Callable[[], ChatAPI]): Creates a provider client of the backend.
+            max_concurrency (int): Maximum number of concurrent requests to the backend.
+            slot_count (Callable[[], int | None]): For llama.cpp backends, returns the number of parallel
+                slots of the server, or None to not pin requests to slots. Only called for a new entry.
+
+        Returns:
+            PooledChatAPI: Chat API with its own settings.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                slots = slot_count() if slot_count is not None else None
+                entry = ProviderPoolEntry(key, factory, max(max_concurrency, 1),
+                                          LlamaCppSlots(slots) if slots else None)
+                self._entries[key] = entry
+        return PooledChatAPI(entry)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return [entry.stats() for entry in entries]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+provider_pool = ProviderPool()
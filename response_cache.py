@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    On-disk cache of provider responses, keyed by a hash of the request messages and settings.
+
+    Each response is stored as the list of its stream chunks in its own file, so a cached stream can
+    be replayed chunk by chunk. When the files exceed max_bytes, the least recently used responses
+    are deleted. Caches of the same folder are shared within the process, see open.
+
+    Attributes:
+        folder (str): Folder holding the cached responses.
+        max_bytes (int): Maximum total size of the cached responses.
+        hits (int): Number of requests answered from the cache.
+        misses (int): Number of requests not found in the cache.
+    """
+    _instances: Dict[str, "ResponseCache"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # File sizes by key, least recently used first.
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        self._scan()
+
+    @classmethod
+    def open(cls, folder: str, max_bytes: int) -> "ResponseCache":
+        """Get the cache of a folder, shared by all game masters of the process."""
+        path = os.path.abspath(folder)
+        with cls._instances_lock:
+            cache = cls._instances.get(path)
+            if cache is None:
+                cache = cls(folder, max_bytes)
+                cls._instances[path] = cache
+            cache.max_bytes = max_bytes
+            return cache
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, Any]], settings: Dict[str, Any], model: str = None) -> str:
+        payload = json.dumps({"model": model, "settings": settings, "messages": messages},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Chunks of the cached response, None if the response is not cached."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                chunks = json.load(f)["chunks"]
+            os.utime(self._path(key))
+        except (OSError, json.JSONDecodeError, KeyError):
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return chunks
+
+    def put(self, key: str, chunks: List[str]) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "chunks": chunks}, f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key = next(iter(self._entries))
+                self._forget(evicted_key)
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            try:
+                os.remove(self._path(evicted_key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _scan(self) -> None:
+        if not os.path.isdir(self.folder):
+            return
+        files = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
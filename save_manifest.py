@@ -0,0 +1,213 @@
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, Any, List, Optional
+
+_FILE_NAME_PATTERN = re.compile(r"^((?:chat_history|save_state)_\d{8}_\d{6})(?:_(\d+))?\.json$")
+
+
+class SaveManifest:
+    """
+    Index of the chat history checkpoints and save states in a game save folder.
+
+    The manifest is kept in save_manifest.json next to the files it describes and is rewritten
+    atomically whenever a checkpoint or save state is written, so loading the latest state does
+    not need to list and sort the whole folder, and folder browsing can show metadata without
+    opening every file.
+
+    Attributes:
+        folder (str): The game save folder.
+        latest_chat_history (str): File name of the most recent chat history checkpoint.
+        latest_save_state (str): File name of the most recent save state.
+        checkpoints (List[Dict[str, Any]]): Metadata of all chat history checkpoints, oldest first.
+        save_states (List[Dict[str, Any]]): Metadata of all save states, oldest first.
+    """
+    MANIFEST_FILE = "save_manifest.json"
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.latest_chat_history: Optional[str] = None
+        self.latest_save_state: Optional[str] = None
+        self.checkpoints: List[Dict[str, Any]] = []
+        self.save_states: List[Dict[str, Any]] = []
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, folder: str) -> "SaveManifest":
+        """
+        Load the manifest of a save folder, rebuilding it from the folder contents if it is missing or corrupt.
+
+        Args:
+            folder (str): The game save folder.
+
+        Returns:
+            SaveManifest: The loaded manifest.
+        """
+        manifest = cls(folder)
+        data = cls.read(folder)
+        if data is None:
+            manifest.rebuild()
+            return manifest
+
+        manifest.latest_chat_history = data.get("latest_chat_history")
+        manifest.latest_save_state = data.get("latest_save_state")
+        manifest.checkpoints = data.get("checkpoints", [])
+        manifest.save_states = data.get("save_states", [])
+        return manifest
+
+    @classmethod
+    def read(cls, folder: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the raw manifest data of a save folder without rebuilding it.
+
+        Args:
+            folder (str): The game save folder.
+
+        Returns:
+            Optional[Dict[str, Any]]: The manifest data, or None if there is no valid manifest.
+        """
+        path = os.path.join(folder, cls.MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def rebuild(self) -> None:
+        """Rebuild the manifest from the chat_history_* and save_state_* files in the folder and save it."""
+        with self.lock:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self.checkpoints = []
+        self.save_states = []
+        if not os.path.exists(self.folder):
+            return
+
+        for filename in sorted(os.listdir(self.folder), key=self._file_order):
+            if not filename.endswith(".json"):
+                continue
+            if filename.startswith("chat_history_"):
+                self.checkpoints.append(self._file_entry(filename))
+            elif filename.startswith("save_state_"):
+                self.save_states.append(self._file_entry(filename))
+
+        self.latest_chat_history = self.checkpoints[-1]["file"] if self.checkpoints else None
+        self.latest_save_state = self.save_states[-1]["file"] if self.save_states else None
+        self._save()
+
+    def record_checkpoint(self, filename: str, messages: List[Dict[str, Any]], tags: List[str] = None) -> None:
+        """
+        Register a newly written chat history checkpoint and save the manifest.
+
+        Args:
+            filename (str): File name of the checkpoint inside the folder.
+            messages (List[Dict[str, Any]]): The messages stored in the checkpoint.
+            tags (List[str], optional): Tags of the checkpoint, like "summarization".
+        """
+        entry = self._file_entry(filename)
+        entry["message_count"] = len(messages)
+        entry["first_id"] = messages[0].get("id") if messages else None
+        entry["last_id"] = messages[-1].get("id") if messages else None
+        if tags:
+            entry["tags"] = list(tags)
+        with self.lock:
+            self._replace_entry(self.checkpoints, entry)
+            self.latest_chat_history = filename
+            self.save()
+
+    def record_save_state(self, filename: str, tags: List[str] = None, **metadata) -> None:
+        """
+        Register a newly written save state and save the manifest.
+
+        Args:
+            filename (str): File name of the save state inside the folder.
+            tags (List[str], optional): Tags of the save state, like "summarization".
+            **metadata: Additional metadata to store with the entry, like the history offset.
+        """
+        entry = self._file_entry(filename)
+        entry.update(metadata)
+        if tags:
+            entry["tags"] = list(tags)
+        with self.lock:
+            self._replace_entry(self.save_states, entry)
+            self.latest_save_state = filename
+            self.save()
+
+    def has_file(self, filename: Optional[str]) -> bool:
+        return filename is not None and os.path.exists(os.path.join(self.folder, filename))
+
+    def summary(self) -> Dict[str, Any]:
+        return self.summarize(self.to_dict())
+
+    @staticmethod
+    def summarize(data: Dict[str, Any]) -> Dict[str, Any]:
+        checkpoints = data.get("checkpoints", [])
+        save_states = data.get("save_states", [])
+        return {
+            "latest_chat_history": data.get("latest_chat_history"),
+            "latest_save_state": data.get("latest_save_state"),
+            "checkpoint_count": len(checkpoints),
+            "save_state_count": len(save_states),
+            "total_bytes": sum(e.get("size", 0) for e in checkpoints + save_states),
+            "message_count": checkpoints[-1].get("message_count") if checkpoints else None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latest_chat_history": self.latest_chat_history,
+            "latest_save_state": self.latest_save_state,
+            "checkpoints": self.checkpoints,
+            "save_states": self.save_states,
+        }
+
+    def save(self) -> None:
+        """Atomically write the manifest, a crash leaves either the old or the new manifest behind."""
+        with self.lock:
+            self._save()
+
+    def _save(self) -> None:
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix=".save_manifest_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, os.path.join(self.folder, self.MANIFEST_FILE))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _file_order(filename: str) -> tuple:
+        # Files written in the same second get a _<n> suffix, which must sort numerically.
+        match = _FILE_NAME_PATTERN.match(filename)
+        if match is None:
+            return filename, 0
+        return match.group(1), int(match.group(2) or 0)
+
+    def _file_entry(self, filename: str) -> Dict[str, Any]:
+        path = os.path.join(self.folder, filename)
+        exists = os.path.exists(path)
+        created = datetime.datetime.fromtimestamp(os.path.getmtime(path)) if exists else datetime.datetime.now()
+        return {
+            "file": filename,
+            "size": os.path.getsize(path) if exists else 0,
+            "created": created.isoformat(timespec="seconds"),
+        }
+
+    @staticmethod
+    def _replace_entry(entries: List[Dict[str, Any]], entry: Dict[str, Any]) -> None:
+        # Saves within the same second reuse the file name, keep a single entry per file.
+        if entries and entries[-1]["file"] == entry["file"]:
+            if "tags" in entries[-1]:
+                entry["tags"] = sorted(set(entries[-1]["tags"]) | set(entry.get("tags", [])))
+            entries[-1] = entry
+        else:
+            entries.append(entry)
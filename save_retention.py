@@ -0,0 +1,124 @@
+import os
+from typing import Dict, Any, List, Iterable, Set
+
+from save_manifest import SaveManifest
+
+
+class RetentionPolicy:
+    """
+    Rules deciding which chat history checkpoints and save states of a save folder are kept.
+
+    A file is kept if any of the rules selects it. The latest chat history and save state are always kept.
+
+    Attributes:
+        keep_last (int): Number of most recent files to keep.
+        keep_hourly (int): Number of hours for which the most recent file of the hour is kept.
+        keep_daily (int): Number of days for which the most recent file of the day is kept.
+        keep_summarization (bool): Keep all files written when the game state got summarized.
+    """
+
+    def __init__(self, keep_last: int = 10, keep_hourly: int = 24, keep_daily: int = 30,
+                 keep_summarization: bool = True):
+        self.keep_last = keep_last
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.keep_summarization = keep_summarization
+
+    @classmethod
+    def from_config(cls, config) -> "RetentionPolicy":
+        return cls(keep_last=config.RETENTION_KEEP_LAST, keep_hourly=config.RETENTION_KEEP_HOURLY,
+                   keep_daily=config.RETENTION_KEEP_DAILY, keep_summarization=config.RETENTION_KEEP_SUMMARIZATION)
+
+    def select(self, entries: List[Dict[str, Any]]) -> Set[str]:
+        """
+        Select the files to keep from a list of manifest entries.
+
+        Args:
+            entries (List[Dict[str, Any]]): Manifest entries of one kind of file, oldest first.
+
+        Returns:
+            Set[str]: File names of the entries to keep.
+        """
+        newest_first = list(reversed(entries))
+        keep = {entry["file"] for entry in newest_first[:max(self.keep_last, 0)]}
+        keep.update(self._one_per_bucket(newest_first, 13, self.keep_hourly))
+        keep.update(self._one_per_bucket(newest_first, 10, self.keep_daily))
+        if self.keep_summarization:
+            keep.update(entry["file"] for entry in entries if "summarization" in entry.get("tags", []))
+        return keep
+
+    @staticmethod
+    def _one_per_bucket(newest_first: List[Dict[str, Any]], key_length: int, bucket_count: int) -> Iterable[str]:
+        # The ISO timestamp truncated to 13 characters is the hour, truncated to 10 characters the day.
+        seen = set()
+        for entry in newest_first:
+            if len(seen) >= bucket_count:
+                break
+            bucket = entry.get("created", "")[:key_length]
+            if bucket not in seen:
+                seen.add(bucket)
+                yield entry["file"]
+
+
+class RetentionReport:
+    def __init__(self):
+        self.deleted_files: List[str] = []
+        self.kept_files = 0
+        self.reclaimed_bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "deleted_files": len(self.deleted_files),
+            "kept_files": self.kept_files,
+            "reclaimed_bytes": self.reclaimed_bytes,
+        }
+
+    def __str__(self) -> str:
+        return (f"Deleted {len(self.deleted_files)} file(s), kept {self.kept_files}, "
+                f"reclaimed {self.reclaimed_bytes / 1024:.1f} KiB.")
+
+
+def prune_save_folder(manifest: SaveManifest, policy: RetentionPolicy,
+                      protected: Iterable[str] = ()) -> RetentionReport:
+    """
+    Delete the checkpoints and save states of a save folder that are not selected by the retention policy.
+
+    Args:
+        manifest (SaveManifest): The manifest of the save folder.
+        policy (RetentionPolicy): The retention policy to apply.
+        protected (Iterable[str]): File names that must never be deleted, like the base checkpoint of the journal.
+
+    Returns:
+        RetentionReport: What got deleted and how many bytes were reclaimed.
+    """
+    report = RetentionReport()
+    with manifest.lock:
+        protected = set(protected)
+        protected.update(f for f in (manifest.latest_chat_history, manifest.latest_save_state) if f)
+
+        removed = []
+        for entries in (manifest.checkpoints, manifest.save_states):
+            keep = policy.select(entries) | protected
+            kept_entries = [entry for entry in entries if entry["file"] in keep]
+            removed.extend(entry for entry in entries if entry["file"] not in keep)
+            report.kept_files += len(kept_entries)
+            entries[:] = kept_entries
+
+        if removed:
+            manifest.save()
+
+    # The manifest no longer references the removed files, so they can be deleted outside the lock.
+    for entry in removed:
+        files = [entry["file"]]
+        if entry.get("game_state_xml_file"):
+            files.append(entry["game_state_xml_file"])
+        for filename in files:
+            path = os.path.join(manifest.folder, filename)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            report.deleted_files.append(filename)
+            report.reclaimed_bytes += size
+    return report
@@ -0,0 +1,172 @@
+import asyncio
+import copy
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from config import VirtualGameMasterConfig
+from virtual_game_master import VirtualGameMaster
+from chat_api_selector import VirtualGameMasterChatAPISelector
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+
+class GameSession:
+    """
+    A campaign hosted by the server.
+
+    Attributes:
+        session_id (str): Id of the session, also the name of its save folder.
+        vgm (VirtualGameMaster | None): The game master of the session, None until it is created on first access.
+        lock (asyncio.Lock): Serializes turns and edits of the session.
+        last_used (float): Monotonic time of the last access.
+    """
+
+    def __init__(self, session_id: str, vgm: VirtualGameMaster | None = None):
+        self.session_id = session_id
+        self.vgm = vgm
+        self.lock = asyncio.Lock()
+        self.loaded = False
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    """
+    Registry of the game sessions of one server process.
+
+    Sessions are created and loaded from their save folder on first access. When more than
+    max_sessions are loaded, the least recently used idle sessions are saved to disk and evicted.
+    """
+
+    def __init__(self, base_config: VirtualGameMasterConfig, sessions_folder: str, max_sessions: int = 64,
+                 debug_mode: bool = False):
+        self.base_config = base_config
+        self.sessions_folder = sessions_folder
+        self.max_sessions = max_sessions
+        self.debug_mode = debug_mode
+        self._sessions: OrderedDict[str, GameSession] = OrderedDict()
+        self._evictions: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, session_id: str) -> GameSession:
+        """
+        Get a session, creating and loading it if it is not in memory.
+
+        Args:
+            session_id (str): Id of the session, letters, digits, '-' and '_' only.
+
+        Returns:
+            GameSession: The loaded session.
+        """
+        if not _SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id}")
+        # Two game masters on one folder would append to the same journal and rewrite the same manifest.
+        if os.path.abspath(self._session_folder(session_id)) == os.path.abspath(self.base_config.GAME_SAVE_FOLDER):
+            raise ValueError(f"Session {session_id} would use the save folder of the active campaign")
+
+        # A session that is being evicted has to be on disk before it can be loaded again.
+        eviction = self._evictions.get(session_id)
+        if eviction is not None:
+            await eviction
+
+        async with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = GameSession(session_id)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            evicted = self._take_evictions(session_id)
+
+        for evicted_session in evicted:
+            self._start_eviction(evicted_session)
+
+        if not session.loaded:
+            async with session.lock:
+                if not session.loaded:
+                    # Creating a game master reads files and may query the provider, keep it off the event loop.
+                    if session.vgm is None:
+                        session.vgm = await asyncio.to_thread(self._create_game_master, session_id)
+                    await asyncio.to_thread(session.vgm.load)
+                    session.loaded = True
+        return session
+
+    def list_sessions(self) -> List[Dict[str, float | str]]:
+        now = time.monotonic()
+        return [{"session_id": session.session_id, "idle_seconds": now - session.last_used,
+                 "busy": session.lock.locked()} for session in self._sessions.values()]
+
+    async def evict_idle(self, max_idle_seconds: float) -> int:
+        """Save and evict all sessions that have not been used for max_idle_seconds."""
+        async with self._lock:
+            now = time.monotonic()
+            evicted = [session for session in self._sessions.values()
+                       if now - session.last_used >= max_idle_seconds and not session.lock.locked()]
+            for session in evicted:
+                del self._sessions[session.session_id]
+        await asyncio.gather(*(self._start_eviction(session) for session in evicted))
+        return len(evicted)
+
+    async def run_idle_eviction(self, max_idle_seconds: float) -> None:
+        """Evict idle sessions until cancelled, checking a few times per max_idle_seconds."""
+        while True:
+            await asyncio.sleep(max(min(max_idle_seconds / 4, 60.0), 1.0))
+            evicted = await self.evict_idle(max_idle_seconds)
+            if evicted and self.debug_mode:
+                print(f"Evicted {evicted} idle sessions")
+
+    async def close(self) -> None:
+        """Save all sessions, called on shutdown."""
+        async with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        await asyncio.gather(*(self._start_eviction(session) for session in sessions))
+        await asyncio.gather(*self._evictions.values())
+
+    def _create_game_master(self, session_id: str) -> VirtualGameMaster:
+        config = copy.copy(self.base_config)
+        config.GAME_SAVE_FOLDER = self._session_folder(session_id)
+        api = VirtualGameMasterChatAPISelector(config).get_api()
+        return VirtualGameMaster(config, api, self.debug_mode)
+
+    def _session_folder(self, session_id: str) -> str:
+        return os.path.join(self.sessions_folder, session_id)
+
+    def _take_evictions(self, requested_session_id: str) -> List[GameSession]:
+        # Called with the registry lock held. Busy sessions are skipped, they get evicted later.
+        evicted = []
+        for session in list(self._sessions.values()):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if session.lock.locked() or session.session_id == requested_session_id:
+                continue
+            del self._sessions[session.session_id]
+            evicted.append(session)
+        return evicted
+
+    def _start_eviction(self, session: GameSession) -> asyncio.Task:
+        task = asyncio.create_task(self._evict(session))
+        self._evictions[session.session_id] = task
+
+        def forget(_):
+            if self._evictions.get(session.session_id) is task:
+                del self._evictions[session.session_id]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def _evict(self, session: GameSession) -> None:
+        async with session.lock:
+            if not session.loaded:
+                return
+            await asyncio.to_thread(self._save_session, session)
+        if self.debug_mode:
+            print(f"Evicted session {session.session_id}")
+
+    @staticmethod
+    def _save_session(session: GameSession) -> None:
+        session.vgm.wait_for_save_state()
+        session.vgm.save()
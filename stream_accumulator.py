@@ -0,0 +1,78 @@
+import time
+from typing import Any, Dict, List, Optional
+
+from token_counter import TokenCounter, approximate_token_count
+
+
+class StreamAccumulator:
+    """
+    Collects the chunks of a streamed response.
+
+    Chunks are appended to a list and only joined when the text is requested, so collecting a
+    response costs linear instead of quadratic time in its length. Statistics are updated with
+    every chunk. Appending from one thread while another thread reads the text is safe.
+
+    Attributes:
+        chunk_count (int): Number of chunks received.
+        char_count (int): Number of characters received.
+        start_time (float): perf_counter time the accumulator was created, usually when the request was sent.
+        first_chunk_time (float | None): perf_counter time of the first chunk.
+        end_time (float | None): perf_counter time finish was called.
+    """
+
+    def __init__(self, token_counter: Optional[TokenCounter] = None):
+        self.chunk_count = 0
+        self.char_count = 0
+        self.start_time = time.perf_counter()
+        self.first_chunk_time: float | None = None
+        self.end_time: float | None = None
+        self._token_counter = token_counter
+        self._chunks: List[str] = []
+        self._text = ""
+        self._joined_chunks = 0
+
+    def append(self, chunk: str) -> None:
+        if self.first_chunk_time is None:
+            self.first_chunk_time = time.perf_counter()
+        self._chunks.append(chunk)
+        self.chunk_count += 1
+        self.char_count += len(chunk)
+
+    def finish(self) -> None:
+        self.end_time = time.perf_counter()
+
+    @property
+    def chunks(self) -> List[str]:
+        return self._chunks[:self.chunk_count]
+
+    def text(self) -> str:
+        """The text received so far, only the chunks added since the last call are joined."""
+        count = self.chunk_count
+        if count != self._joined_chunks:
+            self._text += "".join(self._chunks[self._joined_chunks:count])
+            self._joined_chunks = count
+        return self._text
+
+    @property
+    def tokens(self) -> int:
+        text = self.text()
+        return self._token_counter.count(text) if self._token_counter is not None else approximate_token_count(text)
+
+    @property
+    def time_to_first_chunk(self) -> float | None:
+        return self.first_chunk_time - self.start_time if self.first_chunk_time is not None else None
+
+    @property
+    def stream_duration(self) -> float | None:
+        if self.first_chunk_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.first_chunk_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "chunks": self.chunk_count,
+            "characters": self.char_count,
+            "tokens": self.tokens,
+            "time_to_first_chunk": self.time_to_first_chunk,
+            "stream_duration": self.stream_duration,
+        }
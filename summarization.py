@@ -0,0 +1,43 @@
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class SaveStateJob:
+    """
+    Game state update running on a background thread.
+
+    The job works on a snapshot of the history window, end_index is the number of history messages
+    the snapshot covered. For speculative updates, history_offset, history_snapshot and state_version
+    record what the update was based on, so it can be validated before it is applied.
+    """
+
+    def __init__(self, end_index: int, run: Callable[[], Any], history_offset: int = None,
+                 history_snapshot: List[Dict[str, Any]] = None, state_version: int = None):
+        self.end_index = end_index
+        self.history_offset = history_offset
+        self.history_snapshot = history_snapshot
+        self.state_version = state_version
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._run = run
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._target, daemon=True)
+
+    def start(self) -> "SaveStateJob":
+        self._thread.start()
+        return self
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _target(self) -> None:
+        try:
+            self.result = self._run()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._done.set()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def approximate_token_count(text: str) -> int:
+    """Fast token estimate of about four characters per token, good enough for budgeting the context."""
+    return (len(text) + 3) // 4
+
+
+class TokenCounter:
+    """
+    Counts tokens of message contents and caches the counts keyed by a hash of the content.
+
+    By default the fast approximation is used. An exact tokenizer can be plugged in, see from_config
+    for the tokenizers available per API type. If the exact tokenizer fails, the approximation is used
+    for that text.
+
+    Attributes:
+        name (str): Name of the tokenizer in use.
+        hits (int): Number of counts answered from the cache.
+        misses (int): Number of counts that ran the tokenizer.
+    """
+
+    def __init__(self, tokenizer: Optional[Callable[[str], int]] = None, name: str = "approximate",
+                 max_cache_size: int = 100_000):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._tokenizer = tokenizer or approximate_token_count
+        self._max_cache_size = max_cache_size
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "TokenCounter":
+        """
+        Create the token counter configured by TOKENIZER.
+
+        With TOKENIZER=exact, llamacpp backends count with the /tokenize endpoint of the server and
+        openai, openrouter and groq count with tiktoken if it is installed. Other API types and
+        TOKENIZER=approximate use the approximation.
+        """
+        if config.TOKENIZER != "exact":
+            return cls()
+
+        if config.API_TYPE in ("llamacpp", "llamacpp_custom"):
+            return cls(_llama_cpp_tokenizer(config.API_URL, config.API_KEY), name="llamacpp")
+
+        if config.API_TYPE in ("openai", "openrouter", "openrouter_custom", "groq"):
+            tokenizer = _tiktoken_tokenizer(config.MODEL)
+            if tokenizer is not None:
+                return cls(tokenizer, name="tiktoken")
+
+        return cls()
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return count
+
+        try:
+            count = self._tokenizer(text)
+        except Exception:
+            count = approximate_token_count(text)
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = count
+            if len(self._cache) > self._max_cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+
+def _tiktoken_tokenizer(model: str) -> Optional[Callable[[str], int]]:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _llama_cpp_tokenizer(api_url: str, api_key: Optional[str]) -> Callable[[str], int]:
+    import requests
+
+    session = requests.Session()
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    def tokenize(text: str) -> int:
+        response = session.post(f"{api_url.rstrip('/')}/tokenize", headers=headers,
+                                data=json.dumps({"content": text}), timeout=10)
+        response.raise_for_status()
+        return len(response.json()["tokens"])
+
+    return tokenize
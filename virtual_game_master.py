@@ -1,23 +1,38 @@
+import asyncio
 import datetime
 import json
-import os
+import threading
+import time
 
-from typing import Tuple, Generator
+from typing import Tuple, Generator, AsyncGenerator
 
-from ToolAgents.interfaces.base_llm_agent import BaseToolAgent
-from ToolAgents.utilities import ChatHistory
-from ToolAgents.utilities.chat_history import Message
 from game_state import GameState
-from config import VirtualGameMasterConfig
+from config import VirtualGameMasterConfig, ConfigReloadReport
 from message_template import MessageTemplate
+from prompt_assembly import PromptAssembler, PrefixReuseStats
+from token_counter import TokenCounter
+from chat_api import ChatAPI
+from chat_api_selector import VirtualGameMasterChatAPISelector
+from chat_history import ChatHistory, Message, ChatFormatter
 from command_system import CommandSystem
+import commands
+from async_streaming import iterate_in_thread
+from summarization import SaveStateJob
+from response_cache import ResponseCache
+from metrics import metrics
+from stream_accumulator import StreamAccumulator
+from save_retention import RetentionPolicy, RetentionReport, prune_save_folder
+
+_API_KEYS = {"API_TYPE", "API_URL", "API_URLS", "API_KEY", "MODEL"}
+_SAMPLING_KEYS = {"TEMPERATURE", "TOP_P", "TOP_K", "MIN_P", "TFS_Z", "MAX_TOKENS", "STOP_SEQUENCES"}
+_GAME_KEYS = {"INITIAL_GAME_STATE", "GAME_SAVE_FOLDER", "HISTORY_JOURNAL", "HISTORY_COMPACT_EVERY"}
 
 
 class VirtualGameMaster:
-    def __init__(self, config: VirtualGameMasterConfig, tool_agent: BaseToolAgent, debug_mode: bool = False):
+    def __init__(self, config: VirtualGameMasterConfig, api: ChatAPI, debug_mode: bool = False):
         self.config = config
         CommandSystem.command_prefix = self.config.COMMAND_PREFIX
-        self.tool_agent = tool_agent
+        self.api = api
         self.system_message_template = MessageTemplate.from_file(
             config.SYSTEM_MESSAGE_FILE
         )
@@ -26,56 +41,190 @@ class VirtualGameMaster:
         )
 
         self.game_state = GameState(config.INITIAL_GAME_STATE)
-        self.history = ChatHistory(config.GAME_SAVE_FOLDER)
+        self.token_counter = TokenCounter.from_config(config)
+        self.history = ChatHistory(config.GAME_SAVE_FOLDER, config.HISTORY_JOURNAL, config.HISTORY_COMPACT_EVERY,
+                                   self.token_counter)
+        self.history.add_change_listener(self._on_history_change)
         self.history_offset = 0
 
         self.debug_mode = debug_mode
         self.next_message_id = 0
         self.max_messages = config.MAX_MESSAGES
         self.kept_messages = config.KEPT_MESSAGES
+        self.context_size = config.CONTEXT_SIZE
+        self.kept_tokens = config.KEPT_TOKENS
+        self._offset_tokens = 0
+        self.last_retention_report: RetentionReport | None = None
+        # (game state version, system message, its token count)
+        self._system_message_cache: tuple[int, str, int] | None = None
+        self.prompt_assembler = PromptAssembler(config.PROMPT_LAYOUT, self.token_counter)
+        self.state_lock = threading.RLock()
+        self.save_state_job: SaveStateJob | None = None
+        self.speculative_job: SaveStateJob | None = None
+        self.summarize_ahead = config.SUMMARIZE_AHEAD
+        self.response_cache = self._open_response_cache()
 
     def process_input(self, user_input: str, stream: bool) -> Tuple[str, bool] | Tuple[
         Generator[str, None, None], bool]:
 
         if user_input.startswith(CommandSystem.command_prefix):
-            return CommandSystem.handle_command(self, user_input)
+            with metrics.span("command"):
+                return CommandSystem.handle_command(self, user_input)
 
         if stream:
             return self.get_streaming_response(user_input), False
         return self.get_response(user_input), False
 
+    async def process_input_async(self, user_input: str) -> Tuple[str, bool] | Tuple[
+        AsyncGenerator[str, None], bool]:
+        """Like process_input with streaming, but never blocks the event loop on disk or network I/O."""
+        if user_input.startswith(CommandSystem.command_prefix):
+            with metrics.span("command"):
+                return await asyncio.to_thread(CommandSystem.handle_command, self, user_input)
+
+        return self.get_streaming_response_async(user_input), False
+
     def get_response(self, user_input: str) -> str:
-        history = self.pre_response(user_input)
-        response = self.api.get_response(history)
-        self.post_response(response)
+        with metrics.span("turn"):
+            with metrics.span("pre_response"):
+                history = self.pre_response(user_input)
+            cache_key = self.get_response_cache_key(history)
+            cached = self.response_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                response = "".join(cached)
+            else:
+                with metrics.span("provider"):
+                    response = self.api.get_response(history)
+                if cache_key is not None:
+                    self.response_cache.put(cache_key, [response])
+            with metrics.span("post_response"):
+                self.post_response(response)
 
         return response.strip()
 
     def get_streaming_response(self, user_input: str) -> Generator[str, None, None]:
-        history = self.pre_response(user_input)
-        full_response = ""
-        for response_chunk in self.api.get_streaming_response(history):
-            full_response += response_chunk
+        # Stream phases include the time the consumer takes for each chunk.
+        turn_start = time.perf_counter()
+        with metrics.span("pre_response"):
+            history = self.pre_response(user_input)
+        cache_key = self.get_response_cache_key(history)
+        cached = self.response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None and self.debug_mode:
+            print("Replaying cached response")
+        response = StreamAccumulator(self.token_counter)
+        for response_chunk in cached if cached is not None else self.api.get_streaming_response(history):
+            response.append(response_chunk)
+            yield response_chunk
+        response.finish()
+        if cached is None:
+            metrics.observe_phase("time_to_first_token", response.time_to_first_chunk
+                                  if response.time_to_first_chunk is not None else response.end_time - response.start_time)
+            metrics.observe_phase("stream", response.stream_duration or 0.0)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response.chunks)
+        with metrics.span("post_response"):
+            self.post_response(response.text())
+        metrics.observe_phase("turn", time.perf_counter() - turn_start)
+
+    def get_response_cache_key(self, history: list[dict[str, str]]) -> str | None:
+        """Cache key of a request, None if the response cache is off or the request is not cacheable."""
+        if self.response_cache is None:
+            return None
+        settings = self.api.get_current_settings().to_dict()
+        if self.config.RESPONSE_CACHE == "deterministic" and settings.get("temperature") != 0:
+            return None
+        # Message ids don't change the response, a replayed game gets the same responses.
+        messages = [{"role": message["role"], "content": message["content"]} for message in history]
+        return ResponseCache.make_key(messages, settings, f"{self.config.API_TYPE}/{self.config.MODEL}")
+
+    async def get_streaming_response_async(self, user_input: str) -> AsyncGenerator[str, None]:
+        # The whole turn, including the provider stream and saving, runs on a worker thread.
+        async for response_chunk in iterate_in_thread(self.get_streaming_response(user_input)):
             yield response_chunk
-        self.post_response(full_response)
 
     def pre_response(self, user_input: str) -> list[dict[str, str]]:
-        self.history.add_message(Message("user", user_input.strip()))
+        self.history.add_message(Message("user", user_input.strip(), self.next_message_id))
         self.next_message_id += 1
 
-        history = self.history.to_list()
-        history = history[self.history_offset:]
-        history.insert(0, {"role": "system",
-                           "content": self.get_current_system_message()})
+        with self.state_lock:
+            window_start = self._get_window_start()
+            # Without a known context size a request holds at most two summarization windows.
+            token_limit = self.context_size - self.config.MAX_TOKENS if self.context_size > 0 else None
+            message_limit = 2 * self.max_messages if self.context_size <= 0 else None
+            history = self.prompt_assembler.assemble(self.get_current_system_message, window_start,
+                                                     self.history.window(), token_limit, message_limit)
 
+        metrics.observe("vgm_tokens", "prompt", self.prompt_assembler.last_stats.prompt_tokens)
         if self.debug_mode:
             print(history[0]["content"])
+            print(f"Prompt prefix reuse: {self.prompt_assembler.last_stats}")
 
         return history
 
     def get_current_system_message(self):
-        return self.system_message_template.generate_message_content(
-            self.game_state.template_fields).strip()
+        version = self.game_state.version
+        if self._system_message_cache is None or self._system_message_cache[0] != version:
+            system_message = self.system_message_template.generate_message_content(
+                self.game_state.template_fields).strip()
+            self._system_message_cache = (version, system_message, self.token_counter.count(system_message))
+        return self._system_message_cache[1]
+
+    def get_history_token_budget(self) -> int:
+        """Tokens left for the history window, after the system message and the response."""
+        self.get_current_system_message()
+        return self.context_size - self.config.MAX_TOKENS - self._system_message_cache[2]
+
+    def get_window_tokens(self) -> int:
+        """Approximate tokens of the history window, kept as a running total."""
+        return self.history.total_tokens - self._offset_tokens
+
+    def _get_window_start(self) -> int:
+        # Normally the window starts at the history offset, only if a pending game state update lets
+        # the window outgrow the token budget the oldest messages are left out of the request.
+        start = self.history_offset
+        if self.context_size <= 0:
+            return start
+        excess = self.get_window_tokens() - self.get_history_token_budget()
+        messages = self.history.messages
+        while excess > 0 and start < len(messages) - 1:
+            excess -= self.history.count_tokens(messages[start])
+            start += 1
+        return start
+
+    def _set_history_offset(self, history_offset: int) -> None:
+        with self.history.lock:
+            history_offset = min(max(history_offset, 0), len(self.history.messages))
+            messages = self.history.messages
+            if history_offset >= self.history_offset:
+                self._offset_tokens += sum(self.history.count_tokens(message)
+                                           for message in messages[self.history_offset:history_offset])
+            else:
+                self._offset_tokens = sum(self.history.count_tokens(message) for message in messages[:history_offset])
+            self.history_offset = history_offset
+
+    def _on_history_change(self, position: int, token_delta: int, removed: int) -> None:
+        # Called under the history lock. Changes in front of the window change the tokens in front
+        # of it, deleted messages there also move the window start.
+        if position >= self.history_offset:
+            return
+        if position + removed <= self.history_offset:
+            self._offset_tokens += token_delta
+            self.history_offset -= removed
+        else:
+            # The deleted range reaches into the window, the window now starts where it began.
+            self._offset_tokens = sum(self.history.count_tokens(message) for message in self.history.messages[:position])
+            self.history_offset = position
+
+    def _get_kept_offset(self, end_index: int) -> int:
+        if self.context_size <= 0 or self.kept_tokens <= 0:
+            return end_index - self.kept_messages
+        kept = 0
+        start = end_index
+        messages = self.history.messages
+        while start > 0 and kept + self.history.count_tokens(messages[start - 1]) <= self.kept_tokens:
+            start -= 1
+            kept += self.history.count_tokens(messages[start])
+        return start
 
     def format_history(self, history: list[dict[str, str]]) -> str:
         template = "{role}: {content}\n\n"
@@ -94,7 +243,7 @@ class VirtualGameMaster:
         return output
 
     def get_complete_history_formatted(self):
-        history = self.history.to_list()
+        history = self.history.window()
         return self.format_history(history=history)
 
     def get_current_history_formatted(self):
@@ -103,12 +252,31 @@ class VirtualGameMaster:
 
     def post_response(self, response: str) -> None:
         if len(response.strip()) > 0:
+            metrics.observe("vgm_tokens", "response", self.token_counter.count(response.strip()))
             self.history.add_message(Message("assistant", response.strip(), self.next_message_id))
             self.next_message_id += 1
             self.history.save_history()
 
-            if len(self.history.messages) - self.history_offset >= self.max_messages:
-                self.generate_save_state()
+            window_full, window_nearly_full = self._check_history_window()
+            if window_full:
+                if self.config.BACKGROUND_SUMMARIZATION:
+                    self.start_background_save_state()
+                else:
+                    self.generate_save_state()
+            elif window_nearly_full:
+                self.start_speculative_save_state()
+
+    def _check_history_window(self) -> tuple[bool, bool]:
+        """Check if the history window is full, or within SUMMARIZE_AHEAD messages of being full."""
+        window_size = len(self.history.messages) - self.history_offset
+        if self.context_size > 0:
+            window_tokens = self.get_window_tokens()
+            budget = self.get_history_token_budget()
+            average_tokens = window_tokens / window_size if window_size > 0 else 0
+            return (window_tokens >= budget,
+                    self.summarize_ahead > 0 and window_tokens + self.summarize_ahead * average_tokens >= budget)
+        return (window_size >= self.max_messages,
+                self.summarize_ahead > 0 and window_size >= self.max_messages - self.summarize_ahead)
 
     def edit_message(self, message_id: int, new_content: str) -> bool:
         success = self.history.edit_message(message_id, new_content)
@@ -120,12 +288,110 @@ class VirtualGameMaster:
         self.generate_save_state()
 
     def get_currently_used_history(self):
-        history = self.history.to_list()[self.history_offset:]
+        history = self.history.window(self.history_offset)
         return history
 
     def generate_save_state(self):
-        history = self.history.to_list()[self.history_offset:]
-
+        self.wait_for_save_state()
+        end_index = len(self.history.messages)
+        updates = self._compute_save_state(end_index, echo=True)
+        self._apply_save_state(updates, end_index)
+
+    def start_background_save_state(self) -> SaveStateJob:
+        """
+        Update the game state on a background thread, the current turn returns without waiting for it.
+
+        The update works on a snapshot of the history window. Once it completes, the new template
+        fields and history offset are swapped in together and the game is saved. Messages added in
+        the meantime stay in the history window.
+        """
+        if self.save_state_job is not None and not self.save_state_job.done:
+            return self.save_state_job
+
+        end_index = len(self.history.messages)
+
+        def run():
+            try:
+                updates = self._compute_save_state(end_index, echo=False)
+                self._apply_save_state(updates, end_index)
+            except Exception as e:
+                print(f"Error updating game state in the background: {e}")
+                raise
+            return updates
+
+        self.save_state_job = SaveStateJob(end_index, run).start()
+        return self.save_state_job
+
+    def start_speculative_save_state(self) -> SaveStateJob:
+        """
+        Start computing the next game state update before the history window is full.
+
+        The speculative update only requests the update for the current history window, it is
+        applied by the regular game state update once MAX_MESSAGES is reached. Messages that
+        arrive after the speculative update started are summarized on top of its result.
+        """
+        if self.speculative_job is not None and self.speculative_job.history_offset == self.history_offset:
+            return self.speculative_job
+        if self.save_state_job is not None and not self.save_state_job.done:
+            # The running update is about to move the history offset, speculating now would be wasted.
+            return self.save_state_job
+
+        end_index = len(self.history.messages)
+        history = list(self.history.window(self.history_offset, end_index))
+        prompt_message = self._build_save_state_prompt(history, self.game_state.template_fields)
+
+        self.speculative_job = SaveStateJob(
+            end_index, lambda: self._request_save_state(prompt_message, echo=False),
+            history_offset=self.history_offset, history_snapshot=history,
+            state_version=self.game_state.version).start()
+        return self.speculative_job
+
+    def wait_for_save_state(self, timeout: float = None) -> bool:
+        job = self.save_state_job
+        if job is None:
+            return True
+        return job.wait(timeout)
+
+    def _compute_save_state(self, end_index: int, echo: bool) -> dict[str, str]:
+        """
+        Compute the template field updates for the history window up to end_index.
+
+        Uses the result of a speculative update if it is still valid, then only the messages
+        added after it started are summarized.
+        """
+        with self.state_lock:
+            history_offset = self.history_offset
+            template_fields = self.game_state.template_fields
+            history = list(self.history.window(history_offset, end_index))
+            job, self.speculative_job = self.speculative_job, None
+
+        start = 0
+        updates = {}
+        if job is not None:
+            job.wait()
+            if self._is_speculation_valid(job, history_offset, history):
+                updates = self.game_state.parse_xml_update(job.result)
+                start = job.end_index - history_offset
+            elif self.debug_mode:
+                print("Discarding speculative game state update, the history or game state changed.")
+
+        if start < len(history):
+            prompt_message = self._build_save_state_prompt(history[start:], {**template_fields, **updates})
+            if echo:
+                print(prompt_message[1]["content"])
+            updates.update(self.game_state.parse_xml_update(self._request_save_state(prompt_message, echo)))
+        return updates
+
+    def _is_speculation_valid(self, job: SaveStateJob, history_offset: int,
+                              history: list[dict[str, str]]) -> bool:
+        if job.error is not None or job.result is None:
+            return False
+        if job.history_offset != history_offset or job.state_version != self.game_state.version:
+            return False
+        # Edits and deletions inside the summarized range invalidate the speculative result.
+        return history[:len(job.history_snapshot)] == job.history_snapshot
+
+    def _build_save_state_prompt(self, history: list[dict[str, str]], template_fields: dict) -> list[dict[str, str]]:
         template = "{role}: {content}\n\n"
         role_names = {
             "assistant": "Game Master",
@@ -135,64 +401,186 @@ class VirtualGameMaster:
         formatted_chat = formatter.format_messages(history)
 
         prompt = self.save_system_message_template.generate_message_content(
-            template_fields=self.game_state.template_fields,
+            template_fields=template_fields,
             CHAT_HISTORY=formatted_chat)
 
-        print(prompt)
+        return [{"role": "system",
+                 "content": "You are an AI assistant tasked with updating the game state of a text-based role-playing game."},
+                {"role": "user", "content": prompt}]
 
-        prompt_message = [{"role": "system",
-                           "content": "You are an AI assistant tasked with updating the game state of a text-based role-playing game."},
-                          {"role": "user", "content": prompt}]
-        response_gen = self.api.get_streaming_response(prompt_message)
+    def _request_save_state(self, prompt_message: list[dict[str, str]], echo: bool) -> str:
+        with metrics.span("summarization"):
+            response_gen = self.api.get_streaming_response(prompt_message)
 
-        full_response = ""
-        for response_chunk in response_gen:
-            full_response += response_chunk
-            print(response_chunk, end="", flush=True)
+            response = StreamAccumulator()
+            for response_chunk in response_gen:
+                response.append(response_chunk)
+                if echo:
+                    print(response_chunk, end="", flush=True)
 
         if self.debug_mode:
-            print(f"Update game info:\n{full_response}")
+            print(f"Update game info:\n{response.text()}")
+        return response.text()
+
+    def get_stats(self) -> dict:
+        """Turn phase timings of the process and the cache statistics of this game master."""
+        return {
+            "phases": metrics.summary("vgm_phase_seconds"),
+            "tokens": metrics.summary("vgm_tokens"),
+            "prefix_reuse": PrefixReuseStats(0, self.prompt_assembler.total_reused_tokens,
+                                             self.prompt_assembler.total_prompt_tokens).to_dict(),
+            "token_counter": {"tokenizer": self.token_counter.name, "hits": self.token_counter.hits,
+                              "misses": self.token_counter.misses},
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+        }
 
-        self.game_state.update_from_xml(full_response)
-        self.history_offset = len(self.history.messages) - self.kept_messages
+    def _apply_save_state(self, updates: dict[str, str], end_index: int) -> None:
+        with self.state_lock:
+            self.game_state.update_fields(updates)
+            self._set_history_offset(self._get_kept_offset(end_index))
 
-        self.save()
+        self.save(tags=["summarization"])
 
-    def save(self):
-        self.history.save_history()
+    def save(self, tags: list[str] = None):
+        self.history.save_history(force_checkpoint=True, tags=tags)
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         save_id = f"{timestamp}"
         filename = f"save_state_{save_id}.json"
 
-        save_data = {
-            "config": self.config.to_dict(),
-            "settings": self.api.get_current_settings().to_dict(),
-            "template_fields": self.game_state.template_fields,
-            "history_offset": self.history_offset
-        }
+        with self.state_lock:
+            save_data = {
+                "config": self.config.to_dict(),
+                "settings": self.api.get_current_settings().to_dict(),
+                "template_fields": self.game_state.template_fields,
+                "history_offset": self.history_offset
+            }
         with open(f"{self.config.GAME_SAVE_FOLDER}/{filename}", "w") as f:
             json.dump(save_data, f)
+        self.history.manifest.record_save_state(filename, tags, history_offset=save_data["history_offset"])
+        if self.config.RETENTION_AUTO_PRUNE:
+            self.prune_saves_in_background()
+
+    def prune_saves(self) -> RetentionReport:
+        protected = [self.history.journal_checkpoint] if self.history.journal_checkpoint else []
+        report = prune_save_folder(self.history.manifest, RetentionPolicy.from_config(self.config), protected)
+        self.last_retention_report = report
+        if self.debug_mode:
+            print(f"Pruned save folder: {report}")
+        return report
+
+    def prune_saves_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.prune_saves, daemon=True)
+        thread.start()
+        return thread
+
+    def _open_response_cache(self) -> ResponseCache | None:
+        if self.config.RESPONSE_CACHE not in ("deterministic", "always"):
+            return None
+        return ResponseCache.open(self.config.RESPONSE_CACHE_FOLDER, self.config.RESPONSE_CACHE_MAX_MB * 1024 * 1024)
 
     def load(self):
         self.history.load_history()
-        self.next_message_id = max([msg.id for msg in self.history.messages], default=-1) + 1
+        self.prompt_assembler.reset()
+        self.history_offset = 0
+        self._offset_tokens = 0
+        self.next_message_id = self.history.next_message_id
 
-        save_files = [f for f in os.listdir(self.config.GAME_SAVE_FOLDER) if
-                      f.startswith("save_state_") and f.endswith(".json")]
+        manifest = self.history.manifest
+        latest_save = manifest.latest_save_state
+        if latest_save is not None and not manifest.has_file(latest_save):
+            manifest.rebuild()
+            latest_save = manifest.latest_save_state
 
-        if not save_files:
+        if latest_save is None:
             print("No save state found. Starting a new game.")
             return
 
-        # Sort save files based on the timestamp in the filename
-        latest_save = sorted(save_files, reverse=True)[0]
-
         try:
             with open(f"{self.config.GAME_SAVE_FOLDER}/{latest_save}", "r") as f:
                 save_data = json.load(f)
             self.game_state.template_fields = save_data.get("template_fields", self.game_state.template_fields)
-            self.history_offset = save_data.get("history_offset", 0)
-            self.next_message_id = self.history.messages[-1].id + 1
+            self._set_history_offset(save_data.get("history_offset", 0))
             print(f"Loaded the most recent game state: {latest_save}")
         except (FileNotFoundError, json.JSONDecodeError) as e:
             print(f"Error loading save state: {e}. Starting a new game.")
+
+    def apply_config(self, updates: dict) -> ConfigReloadReport:
+        """
+        Apply configuration changes to the running game master.
+
+        Only the components whose inputs changed are rebuilt: sampling settings are set on the
+        current API in place, the API client is only re-created when the provider changed, templates
+        are re-read when their files changed and the game state and history are only reloaded when
+        the starter or the save folder changed.
+
+        Args:
+            updates (dict): Config keys and their new values.
+
+        Returns:
+            ConfigReloadReport: The changed keys, the rebuilt components and the reload time.
+        """
+        start = time.perf_counter()
+        previous = self.config.to_dict()
+        self.config.update(updates)
+        changed = {key for key, value in self.config.to_dict().items() if previous.get(key) != value}
+        report = ConfigReloadReport(sorted(changed))
+
+        # A running game state update must not be applied to a rebuilt game.
+        self.wait_for_save_state()
+        with self.state_lock:
+            selector = VirtualGameMasterChatAPISelector(self.config)
+            if changed & _API_KEYS:
+                self.api = selector.get_api()
+                report.rebuilt.append("api")
+            elif changed & _SAMPLING_KEYS:
+                selector.apply_settings(self.api)
+                report.rebuilt.append("sampling settings")
+
+            if changed & (_API_KEYS | {"TOKENIZER"}):
+                self.token_counter = TokenCounter.from_config(self.config)
+                self.prompt_assembler.token_counter = self.token_counter
+                self.history.set_token_counter(self.token_counter)
+                self._system_message_cache = None
+                history_offset, self.history_offset, self._offset_tokens = self.history_offset, 0, 0
+                self._set_history_offset(history_offset)
+                report.rebuilt.append("token counter")
+
+            if "SYSTEM_MESSAGE_FILE" in changed:
+                self.system_message_template = MessageTemplate.from_file(self.config.SYSTEM_MESSAGE_FILE)
+                self._system_message_cache = None
+                report.rebuilt.append("system message template")
+            if "SAVE_SYSTEM_MESSAGE_FILE" in changed:
+                self.save_system_message_template = MessageTemplate.from_file(self.config.SAVE_SYSTEM_MESSAGE_FILE)
+                report.rebuilt.append("save system message template")
+
+            if "PROMPT_LAYOUT" in changed:
+                self.prompt_assembler = PromptAssembler(self.config.PROMPT_LAYOUT, self.token_counter)
+                report.rebuilt.append("prompt assembler")
+            elif "SYSTEM_MESSAGE_FILE" in changed:
+                self.prompt_assembler.reset()
+
+            if "COMMAND_PREFIX" in changed:
+                CommandSystem.command_prefix = self.config.COMMAND_PREFIX
+            self.max_messages = self.config.MAX_MESSAGES
+            self.kept_messages = self.config.KEPT_MESSAGES
+            self.context_size = self.config.CONTEXT_SIZE
+            self.kept_tokens = self.config.KEPT_TOKENS
+            self.summarize_ahead = self.config.SUMMARIZE_AHEAD
+            if changed & {"RESPONSE_CACHE", "RESPONSE_CACHE_FOLDER", "RESPONSE_CACHE_MAX_MB"}:
+                self.response_cache = self._open_response_cache()
+                report.rebuilt.append("response cache")
+
+            if changed & _GAME_KEYS:
+                self.speculative_job = None
+                self.game_state = GameState(self.config.INITIAL_GAME_STATE)
+                self._system_message_cache = None
+                self.history = ChatHistory(self.config.GAME_SAVE_FOLDER, self.config.HISTORY_JOURNAL,
+                                           self.config.HISTORY_COMPACT_EVERY, self.token_counter)
+                self.history.add_change_listener(self._on_history_change)
+                self.load()
+                report.rebuilt.append("game state and history")
+
+        report.duration = time.perf_counter() - start
+        if self.debug_mode:
+            print(report)
+        return report
@@ -1,16 +1,20 @@
 import datetime
 import json
-import os
+import threading
 
 from typing import Tuple, Generator
 
 from xml_game_state import XMLGameState
 from config import VirtualGameMasterConfig
 from message_template import MessageTemplate
+from prompt_assembly import PromptAssembler, PrefixReuseStats
+from metrics import metrics
 from chat_api import ChatAPI, AnthropicSettings
 from chat_history import ChatHistory, Message, ChatFormatter
 
 from command_system import CommandSystem
+from save_retention import RetentionPolicy, RetentionReport, prune_save_folder
+from stream_accumulator import StreamAccumulator
 import commands
 
 
@@ -27,13 +31,29 @@ class VirtualGameMasterXMLGameState:
         )
 
         self.game_state = XMLGameState(config.INITIAL_GAME_STATE)
-        self.history = ChatHistory(config.GAME_SAVE_FOLDER)
+        self.history = ChatHistory(config.GAME_SAVE_FOLDER, config.HISTORY_JOURNAL, config.HISTORY_COMPACT_EVERY)
         self.history_offset = 0
 
         self.debug_mode = debug_mode
         self.next_message_id = 0
         self.max_messages = config.MAX_MESSAGES
         self.kept_messages = config.KEPT_MESSAGES
+        self.last_retention_report: RetentionReport | None = None
+        self._system_message_cache: tuple[int, str] | None = None
+        self.prompt_assembler = PromptAssembler(config.PROMPT_LAYOUT)
+
+    def get_stats(self) -> dict:
+        """Turn phase timings of the process and the cache statistics of this game master."""
+        token_counter = self.history.token_counter
+        return {
+            "phases": metrics.summary("vgm_phase_seconds"),
+            "tokens": metrics.summary("vgm_tokens"),
+            "prefix_reuse": PrefixReuseStats(0, self.prompt_assembler.total_reused_tokens,
+                                             self.prompt_assembler.total_prompt_tokens).to_dict(),
+            "token_counter": {"tokenizer": token_counter.name, "hits": token_counter.hits,
+                              "misses": token_counter.misses},
+            "response_cache": None,
+        }
 
     def process_input(self, user_input: str, stream: bool) -> Tuple[str, bool] | Tuple[
         Generator[str, None, None], bool]:
@@ -54,29 +74,31 @@ class VirtualGameMasterXMLGameState:
 
     def get_streaming_response(self, user_input: str) -> Generator[str, None, None]:
         history = self.pre_response(user_input)
-        full_response = ""
+        response = StreamAccumulator()
         for response_chunk in self.api.get_streaming_response(history):
-            full_response += response_chunk
+            response.append(response_chunk)
             yield response_chunk
-        self.post_response(full_response)
+        self.post_response(response.text())
 
     def pre_response(self, user_input: str) -> list[dict[str, str]]:
         self.history.add_message(Message("user", user_input.strip(), self.next_message_id))
         self.next_message_id += 1
 
-        history = self.history.to_list()
-        history = history[self.history_offset:]
-        history.insert(0, {"role": "system",
-                           "content": self.get_current_system_message()})
+        history = self.prompt_assembler.assemble(self.get_current_system_message, self.history_offset,
+                                                 self.history.window(), message_limit=2 * self.max_messages)
 
         if self.debug_mode:
             print(history[0]["content"])
+            print(f"Prompt prefix reuse: {self.prompt_assembler.last_stats}")
 
         return history
 
     def get_current_system_message(self):
-        return self.system_message_template.generate_message_content(
-            game_state=self.game_state.get_xml_string()).strip()
+        version = self.game_state.version
+        if self._system_message_cache is None or self._system_message_cache[0] != version:
+            self._system_message_cache = (version, self.system_message_template.generate_message_content(
+                game_state=self.game_state.get_xml_string()).strip())
+        return self._system_message_cache[1]
 
     def format_history(self, history: list[dict[str, str]]) -> str:
         template = "{role}: {content}\n\n"
@@ -95,7 +117,7 @@ class VirtualGameMasterXMLGameState:
         return output
 
     def get_complete_history_formatted(self):
-        history = self.history.to_list()
+        history = self.history.window()
         return self.format_history(history=history)
 
     def get_current_history_formatted(self):
@@ -120,12 +142,16 @@ class VirtualGameMasterXMLGameState:
     def manual_save(self):
         self.generate_save_state()
 
+    def wait_for_save_state(self, timeout: float = None) -> bool:
+        # The game state is always updated synchronously here.
+        return True
+
     def get_currently_used_history(self):
-        history = self.history.to_list()[self.history_offset:]
+        history = self.history.window(self.history_offset)
         return history
 
     def generate_save_state(self):
-        history = self.history.to_list()[self.history_offset:]
+        history = self.history.window(self.history_offset)
 
         template = "{role}: {content}\n\n"
         role_names = {
@@ -151,23 +177,23 @@ class VirtualGameMasterXMLGameState:
                           {"role": "user", "content": "Provide the updated and added elements in XML format, nothing else!"}]
         response_gen = self.api.get_streaming_response(prompt_message)
 
-        full_response = ""
+        response = StreamAccumulator()
         for response_chunk in response_gen:
-            full_response += response_chunk
+            response.append(response_chunk)
             print(response_chunk, end="", flush=True)
 
         if self.debug_mode:
-            print(f"Update game info:\n{full_response}")
+            print(f"Update game info:\n{response.text()}")
 
-        self.game_state.update_xml_from_string(full_response)
+        self.game_state.update_xml_from_string(response.text())
         self.history_offset = len(self.history.messages) - self.kept_messages
 
-        self.save()
+        self.save(tags=["summarization"])
         if isinstance(settings, AnthropicSettings):
             settings.cache_system_prompt = True
 
-    def save(self):
-        self.history.save_history()
+    def save(self, tags: list[str] = None):
+        self.history.save_history(force_checkpoint=True, tags=tags)
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         save_id = f"{timestamp}"
         filename = f"save_state_{save_id}.json"
@@ -181,27 +207,44 @@ class VirtualGameMasterXMLGameState:
         }
         with open(f"{self.config.GAME_SAVE_FOLDER}/{filename}", "w") as f:
             json.dump(save_data, f)
+        self.history.manifest.record_save_state(filename, tags, history_offset=self.history_offset,
+                                                game_state_xml_file=filename_xml_game_state)
+        if self.config.RETENTION_AUTO_PRUNE:
+            self.prune_saves_in_background()
+
+    def prune_saves(self) -> RetentionReport:
+        protected = [self.history.journal_checkpoint] if self.history.journal_checkpoint else []
+        report = prune_save_folder(self.history.manifest, RetentionPolicy.from_config(self.config), protected)
+        self.last_retention_report = report
+        if self.debug_mode:
+            print(f"Pruned save folder: {report}")
+        return report
+
+    def prune_saves_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.prune_saves, daemon=True)
+        thread.start()
+        return thread
 
     def load(self):
         self.history.load_history()
-        self.next_message_id = max([msg.id for msg in self.history.messages], default=-1) + 1
+        self.prompt_assembler.reset()
+        self.next_message_id = self.history.next_message_id
 
-        save_files = [f for f in os.listdir(self.config.GAME_SAVE_FOLDER) if
-                      f.startswith("save_state_") and f.endswith(".json")]
+        manifest = self.history.manifest
+        latest_save = manifest.latest_save_state
+        if latest_save is not None and not manifest.has_file(latest_save):
+            manifest.rebuild()
+            latest_save = manifest.latest_save_state
 
-        if not save_files:
+        if latest_save is None:
             print("No save state found. Starting a new game.")
             return
 
-        # Sort save files based on the timestamp in the filename
-        latest_save = sorted(save_files, reverse=True)[0]
-
         try:
             with open(f"{self.config.GAME_SAVE_FOLDER}/{latest_save}", "r") as f:
                 save_data = json.load(f)
             self.game_state.load_from_xml_file(save_data.get(f"{self.config.GAME_SAVE_FOLDER}/{save_data["game_state_xml_file"]}"))
             self.history_offset = save_data.get("history_offset", 0)
-            self.next_message_id = self.history.messages[-1].id + 1
             print(f"Loaded the most recent game state: {latest_save}")
         except (FileNotFoundError, json.JSONDecodeError) as e:
             print(f"Error loading save state: {e}. Starting a new game.")
@@ -70,6 +70,7 @@ def xml_to_string(root):
 
 class XMLGameState:
     def __init__(self, initial_state_file: str):
+        self.version = 0
         self.xml_root_node = self.load_yaml_initial_game_state(initial_state_file)
 
     def load_yaml_initial_game_state(self, file_path: str):
@@ -80,6 +81,7 @@ class XMLGameState:
 
     def update_xml_from_string(self, xml_string: str):
         merge_xml_update(self.xml_root_node, xml_string.replace("\n", "").replace("\r", "").replace("\t", "").replace("  ", ""))
+        self.version += 1
 
     def save_to_xml_file(self, file_path: str):
         with open(file_path, 'w', encoding='utf-8') as file:
@@ -88,3 +90,4 @@ class XMLGameState:
     def load_from_xml_file(self, file_path: str):
         with open(file_path, 'r', encoding='utf-8') as file:
             self.xml_root_node = ET.fromstring(file.read())
+        self.version += 1